@@ -0,0 +1,189 @@
+# audit.py
+"""
+Login audit events and last-login stamps, written off the request path.
+
+The login handler calls record(). The event goes into a bounded
+jobs.EventBuffer and the request returns without touching the database. The
+buffer is flushed every AUDIT_FLUSH_INTERVAL_SECONDS, or as soon as
+AUDIT_FLUSH_BATCH_SIZE events are pending. Each flush is one transaction:
+a multi-row INSERT into login_events (SQLAlchemy batches executemany into
+INSERT ... VALUES (...), (...)) plus one upsert of user_last_logins for the
+successful logins in the batch.
+
+Backpressure: at most AUDIT_BUFFER_LIMIT events are held per worker. Beyond
+that AUDIT_DROP_POLICY drops the newest (default) or the oldest events and
+counts them (/health, /metrics), so the audit trail can never slow logins.
+
+On PostgreSQL login_events is range-partitioned by month. A periodic job
+creates the partitions for the current month and AUDIT_PARTITIONS_AHEAD
+months ahead; rows for a month without one land in login_events_default.
+"""
+import os
+import uuid
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import DateTime, String, bindparam, insert, select, text
+
+import jobs
+import ratelimit
+from models import LoginEvent, User, UserLastLogin, normalize_email
+
+AUDIT_FLUSH_INTERVAL_SECONDS = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "2"))
+AUDIT_FLUSH_BATCH_SIZE = int(os.getenv("AUDIT_FLUSH_BATCH_SIZE", "1000"))
+AUDIT_BUFFER_LIMIT = int(os.getenv("AUDIT_BUFFER_LIMIT", "50000"))
+AUDIT_DROP_POLICY = os.getenv("AUDIT_DROP_POLICY", "newest").lower()  # newest | oldest
+AUDIT_PARTITIONS_AHEAD = int(os.getenv("AUDIT_PARTITIONS_AHEAD", "2"))
+AUDIT_PARTITION_INTERVAL_SECONDS = float(os.getenv("AUDIT_PARTITION_INTERVAL_SECONDS", "21600"))
+
+LOGIN_SUCCEEDED = "login_succeeded"
+LOGIN_FAILED = "login_failed"
+LOGIN_UNVERIFIED = "login_unverified"
+
+
+def record(event, request, email, user=None):
+    """Buffer one login event; user is the cached user dict when the email matched an account"""
+    buffer.add({
+        "id": uuid.uuid4().hex,
+        "occurred_at": datetime.utcnow(),
+        "event": event,
+        "user_id": user["user_id"] if user else None,
+        "user_pk": user["id"] if user else None,
+        "email": normalize_email(email)[:320],
+        "ip": ratelimit.client_ip(request)[:64],
+        "user_agent": request.headers.get("user-agent", "")[:255] or None,
+    })
+
+
+def _last_login_stmt(bind):
+    from database import dialect_insert
+
+    # INSERT ... SELECT from users, so a user deleted since the login is skipped
+    # instead of failing the whole batch on the foreign key
+    stmt = dialect_insert(bind, UserLastLogin).from_select(
+        ["user_id", "last_login_at", "last_login_ip"],
+        select(
+            User.id,
+            bindparam("at", type_=DateTime),
+            bindparam("ip", type_=String),
+        ).where(User.id == bindparam("pk")),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[UserLastLogin.user_id],
+        set_={"last_login_at": stmt.excluded.last_login_at, "last_login_ip": stmt.excluded.last_login_ip},
+        # Workers flush independently; never move last_login_at backwards
+        where=UserLastLogin.last_login_at < stmt.excluded.last_login_at,
+    )
+
+
+def _write(batch):
+    from database import engine
+
+    events = [{k: v for k, v in e.items() if k != "user_pk"} for e in batch]
+    last_logins = {}
+    for e in batch:  # in arrival order, so the last success per user wins
+        if e["event"] == LOGIN_SUCCEEDED and e["user_pk"] is not None:
+            last_logins[e["user_pk"]] = {"pk": e["user_pk"], "at": e["occurred_at"], "ip": e["ip"]}
+    with engine.begin() as conn:
+        conn.execute(insert(LoginEvent), events)
+        if last_logins:
+            conn.execute(_last_login_stmt(conn), list(last_logins.values()))
+
+
+buffer = jobs.EventBuffer(
+    "audit.flush",
+    _write,
+    interval=AUDIT_FLUSH_INTERVAL_SECONDS,
+    limit=AUDIT_BUFFER_LIMIT,
+    flush_at=AUDIT_FLUSH_BATCH_SIZE,
+    drop_policy=AUDIT_DROP_POLICY,
+)
+
+
+def flush():
+    """Write every buffered event now; returns the number written"""
+    return buffer.flush()
+
+
+# ----------------------------
+# Monthly partitions (PostgreSQL)
+# ----------------------------
+def _month_bounds(months_ahead):
+    month = date.today().replace(day=1)
+    for _ in range(months_ahead + 1):
+        following = (month + timedelta(days=32)).replace(day=1)
+        yield month, following
+        month = following
+
+
+def ensure_partitions(months_ahead=AUDIT_PARTITIONS_AHEAD):
+    """Scheduled job: create missing monthly login_events partitions; returns the names created"""
+    from database import engine
+
+    if engine.dialect.name != "postgresql":
+        return jobs.STOP  # plain table elsewhere
+    created = []
+    for start, end in _month_bounds(months_ahead):
+        name = f"login_events_{start:%Y_%m}"
+        # Check first: CREATE ... PARTITION OF locks the parent even when it is a no-op
+        with engine.begin() as conn:
+            if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+                continue
+            try:
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF login_events "
+                    f"FOR VALUES FROM ('{start}') TO ('{end}')"
+                ))
+            except Exception as e:
+                # Another worker won the race, or the default partition already
+                # holds rows for this month and must be split by hand
+                print(f"❌ Could not create partition {name}: {e}")
+                continue
+        created.append(name)
+    if created:
+        print(f"🗓️ Created login_events partitions: {', '.join(created)}")
+    return created
+
+
+# ----------------------------
+# Queries (GET /auth/login-events)
+# ----------------------------
+def events_stmt(user_id=None, email=None, event=None, since=None, until=None, before=None):
+    """Newest first; before is the (occurred_at, id) of the last row of the previous page"""
+    stmt = select(
+        LoginEvent.id, LoginEvent.occurred_at, LoginEvent.event, LoginEvent.user_id,
+        LoginEvent.email, LoginEvent.ip, LoginEvent.user_agent,
+    )
+    if user_id is not None:
+        stmt = stmt.where(LoginEvent.user_id == user_id)
+    if email is not None:
+        stmt = stmt.where(LoginEvent.email == email)
+    if event is not None:
+        stmt = stmt.where(LoginEvent.event == event)
+    if since is not None:
+        stmt = stmt.where(LoginEvent.occurred_at >= since)
+    if until is not None:
+        stmt = stmt.where(LoginEvent.occurred_at < until)
+    if before is not None:
+        occurred_at, event_id = before
+        stmt = stmt.where(
+            (LoginEvent.occurred_at < occurred_at)
+            | ((LoginEvent.occurred_at == occurred_at) & (LoginEvent.id < event_id))
+        )
+    return stmt.order_by(LoginEvent.occurred_at.desc(), LoginEvent.id.desc())
+
+
+def last_login_stmt(user_id=None, email=None):
+    stmt = select(UserLastLogin.last_login_at, UserLastLogin.last_login_ip).join(
+        User, User.id == UserLastLogin.user_id
+    )
+    if user_id is not None:
+        stmt = stmt.where(User.user_id == user_id)
+    if email is not None:
+        stmt = stmt.where(User.email_normalized == email)
+    return stmt
+
+
+def get_stats():
+    stats = buffer.get_stats()
+    stats["drop_policy"] = buffer.drop_policy
+    return stats
@@ -1,12 +1,59 @@
 # auth.py
 import os
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict, namedtuple
 from datetime import datetime, timedelta
+from typing import Optional
 import jwt
+from fastapi import Depends, Header, HTTPException
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-SECRET_KEY = os.getenv("JWT_SECRET", "changeme")
-ALGORITHM = "HS256"
+import jwt_keys
+import metrics
+
+# ----------------------------
+# Password hashing policy
+# PASSWORD_HASH_SCHEME picks the scheme for new hashes; the other scheme is
+# still verified but marked deprecated, and bcrypt hashes below BCRYPT_ROUNDS
+# count as outdated, so verify_and_update() upgrades legacy hashes on login.
+# Run `python calibrate_hashing.py` to pick BCRYPT_ROUNDS for the host.
+# ----------------------------
+PASSWORD_HASH_SCHEME = os.getenv("PASSWORD_HASH_SCHEME", "bcrypt").lower()  # "bcrypt" or "argon2"
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST_KIB = int(os.getenv("ARGON2_MEMORY_COST_KIB", "65536"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+
+
+def build_pwd_context(scheme=PASSWORD_HASH_SCHEME, bcrypt_rounds=BCRYPT_ROUNDS):
+    if scheme not in ("bcrypt", "argon2"):
+        raise ValueError(f"Unsupported PASSWORD_HASH_SCHEME: {scheme}")
+    settings = {
+        "bcrypt__default_rounds": bcrypt_rounds,
+        "bcrypt__min_rounds": bcrypt_rounds,
+    }
+    schemes = ["bcrypt"]
+    if scheme == "argon2":
+        try:
+            import argon2  # noqa: F401
+        except ImportError:
+            raise RuntimeError("PASSWORD_HASH_SCHEME=argon2 requires the 'argon2-cffi' package")
+        schemes = ["argon2", "bcrypt"]
+        settings.update({
+            "argon2__type": "ID",
+            "argon2__time_cost": ARGON2_TIME_COST,
+            "argon2__memory_cost": ARGON2_MEMORY_COST_KIB,
+            "argon2__parallelism": ARGON2_PARALLELISM,
+        })
+    return CryptContext(schemes=schemes, deprecated="auto", **settings)
+
+
+pwd_context = build_pwd_context()
+SECRET_KEY = jwt_keys.JWT_SECRET
+ALGORITHM = jwt_keys.JWT_ALGORITHM  # HS256, RS256 or EdDSA; see jwt_keys.py
 ACCESS_TOKEN_EXPIRE_MINUTES = 15  # common default expiration
 
 def verify_password(plain_password, hashed_password):
@@ -15,6 +62,13 @@ def verify_password(plain_password, hashed_password):
     plain_password_truncated = plain_password_bytes.decode('utf-8', errors='ignore')
     return pwd_context.verify(plain_password_truncated, hashed_password)
 
+def verify_and_update(plain_password, hashed_password):
+    """Verify, and when the hash is outdated under the current policy also return
+    a replacement: (ok, new_hash_or_None)"""
+    plain_password_bytes = plain_password.encode('utf-8')[:72]
+    plain_password_truncated = plain_password_bytes.decode('utf-8', errors='ignore')
+    return pwd_context.verify_and_update(plain_password_truncated, hashed_password)
+
 def get_password_hash(password):
     # Truncate password to 72 bytes to prevent bcrypt errors
     password_bytes = password.encode('utf-8')[:72]
@@ -22,11 +76,167 @@ def get_password_hash(password):
     return pwd_context.hash(password_truncated)
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
+    started = time.perf_counter()
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    key, algorithm, headers = jwt_keys.get_keyring().signing_key()
+    encoded_jwt = jwt.encode(to_encode, key, algorithm=algorithm, headers=headers)
+    elapsed = time.perf_counter() - started
+    metrics.JWT_LATENCY.observe(elapsed, "encode")
+    metrics.record_stage("jwt", elapsed)
     return encoded_jwt
+
+def require_service_token(x_service_token: str = Header(default="")):
+    """Dependency guarding service-to-service endpoints with X-Service-Token"""
+    internal_token = os.getenv("INTERNAL_SERVICE_TOKEN", "")
+    if not internal_token:
+        raise HTTPException(status_code=500, detail="Server missing INTERNAL_SERVICE_TOKEN")
+    if not hmac.compare_digest(x_service_token.encode("utf-8"), internal_token.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+# ----------------------------
+# Current-user dependency with decoded-token cache
+# Hot sessions are served from an in-process LRU keyed on the token digest, so
+# repeated requests with the same bearer token skip jwt.decode and the User
+# lookup. Entries never outlive the token's exp and are evicted explicitly when
+# a user's password changes or the account is deleted. The cache is per worker
+# process; TOKEN_CACHE_TTL_SECONDS bounds how stale another worker can be.
+# ----------------------------
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+
+# Minimal projection of models.User carried by authenticated requests
+CurrentUser = namedtuple("CurrentUser", ["id", "user_id", "email", "username", "is_active", "is_verified"])
+
+
+class TokenCache:
+    """Bounded LRU of token digest -> (claims, CurrentUser, expires_at)"""
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[2] <= time.time():
+                self._remove(digest)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry
+
+    def put(self, digest, claims, user, exp):
+        if self.maxsize <= 0:
+            return
+        expires_at = min(exp, time.time() + self.ttl)
+        with self._lock:
+            if digest in self._entries:
+                self._remove(digest)
+            self._entries[digest] = (claims, user, expires_at)
+            self._by_user.setdefault(user.user_id, set()).add(digest)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        """Drop every cached token for a user (password change, delete, ...)"""
+        with self._lock:
+            for digest in self._by_user.pop(user_id, set()):
+                self._entries.pop(digest, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, digest):
+        claims, user, _ = self._entries.pop(digest)
+        digests = self._by_user.get(user.user_id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_user[user.user_id]
+
+
+token_cache = TokenCache()
+
+
+def decode_access_token(token: str):
+    started = time.perf_counter()
+    try:
+        key, algorithm = jwt_keys.get_keyring().verification_key(jwt.get_unverified_header(token))
+        payload = jwt.decode(token, key, algorithms=[algorithm])
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.JWT_LATENCY.observe(elapsed, "decode")
+        metrics.record_stage("jwt", elapsed)
+    if not payload.get("user_id"):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+
+def get_bearer_token(token: Optional[str] = None, authorization: str = Header(default="")):
+    """Accept the token as an Authorization: Bearer header or a ?token= query param"""
+    scheme, _, credentials = authorization.partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        return credentials
+    if token:
+        return token
+    raise HTTPException(status_code=401, detail="Invalid token")
+
+
+def get_current_user(token: str = Depends(get_bearer_token)) -> CurrentUser:
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    cached = token_cache.get(digest)
+    if cached is not None:
+        return cached[1]
+
+    claims = decode_access_token(token)
+    from database import SessionLocal
+    import user_cache  # imported lazily so auth stays importable without a database
+    with SessionLocal() as db:
+        profile = user_cache.load_by_user_id(db, claims["user_id"])
+    if not profile:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    user = CurrentUser(*(profile[field] for field in CurrentUser._fields))
+    token_cache.put(digest, claims, user, claims["exp"])
+    return user
+
+
+async def get_current_user_async(token: str = Depends(get_bearer_token)) -> CurrentUser:
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    cached = token_cache.get(digest)
+    if cached is not None:
+        return cached[1]
+
+    claims = decode_access_token(token)
+    import database
+    import user_cache
+    async with database.AsyncSessionLocal() as db:
+        profile = await user_cache.aload_by_user_id(db, claims["user_id"])
+    if not profile:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    user = CurrentUser(*(profile[field] for field in CurrentUser._fields))
+    token_cache.put(digest, claims, user, claims["exp"])
+    return user
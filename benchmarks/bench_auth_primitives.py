@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the CPU-bound auth primitives, isolated from HTTP and the DB:
+auth.get_password_hash, auth.verify_password and create_access_token / JWT decode.
+
+    python -m benchmarks.bench_auth_primitives --iterations 50 --output primitives.json
+"""
+import argparse
+
+import auth
+from benchmarks.common import environment, time_calls, write_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20, help="Calls per bcrypt benchmark")
+    parser.add_argument("--jwt-iterations", type=int, default=5000, help="Calls per JWT benchmark")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    password = "benchmark-password-123"
+    hashed = auth.get_password_hash(password)
+    token = auth.create_access_token(data={"user_id": "benchmark-user"})
+
+    report = {
+        "benchmark": "auth_primitives",
+        "environment": environment(),
+        "config": {
+            "iterations": args.iterations,
+            "jwt_iterations": args.jwt_iterations,
+            "hash_scheme": auth.pwd_context.identify(hashed),
+            "jwt_algorithm": auth.ALGORITHM,
+        },
+        "results": {
+            "get_password_hash": time_calls(lambda: auth.get_password_hash(password), args.iterations),
+            "verify_password": time_calls(lambda: auth.verify_password(password, hashed), args.iterations),
+            "create_access_token": time_calls(
+                lambda: auth.create_access_token(data={"user_id": "benchmark-user"}), args.jwt_iterations
+            ),
+            "decode_access_token": time_calls(
+                lambda: auth.decode_access_token(token), args.jwt_iterations
+            ),
+        },
+    }
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Per-response serialization cost, isolated from HTTP and the DB.
+
+For each payload shape it times the three ways FastAPI can turn a handler's
+return value into a response body:
+  response_model    - dict validated against the route's response model, then
+                      dumped to JSON by Pydantic (login/signup/refresh before)
+  jsonable_encoder  - dict walked by jsonable_encoder, then json.dumps via
+                      JSONResponse (model-less dict routes before)
+  orjson            - the handler returns responses.ORJSONResponse(payload)
+                      directly: no validation, no encoder pass (after)
+
+    python -m benchmarks.bench_serialization --iterations 20000 --output serialization.json
+"""
+import argparse
+import uuid
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+import schemas
+from benchmarks.common import environment, time_calls, write_report
+from responses import ORJSONResponse
+
+
+def _user(i):
+    return {
+        "id": i,
+        "user_id": str(uuid.uuid4()),
+        "email": f"user{i}@example.com",
+        "username": f"user{i}",
+        "is_active": True,
+        "is_verified": True,
+        "created_at": datetime(2024, 1, 1, 12, 0, i % 60).isoformat(),
+    }
+
+
+def payloads():
+    """name -> (payload, response model or None, variant the endpoint used before)"""
+    user = _user(1)
+    login = {
+        "access_token": "e" * 320,  # roughly an RS256 access token
+        "refresh_token": "r" * 43,
+        "token_type": "bearer",
+        "user_id": user["user_id"],
+        "email": user["email"],
+        "username": user["username"],
+        "is_active": True,
+        "is_verified": True,
+    }
+    signup = {
+        **{k: v for k, v in user.items() if k != "created_at"},
+        "is_verified": False,
+        "verificationToken": str(uuid.uuid4()),
+    }
+    lookup = {"users": [_user(i) for i in range(100)], "missing_emails": [], "missing_user_ids": []}
+    return {
+        "login": (login, schemas.LoginResponse, "response_model"),
+        "signup": (signup, schemas.SignupResponse, "response_model"),
+        "by_email": (user, schemas.UserPublic, "jsonable_encoder"),
+        "lookup_100_users": (lookup, None, "jsonable_encoder"),
+    }
+
+
+def _run(coro):
+    # serialize_response never awaits when is_coroutine=True; drive it without an event loop
+    try:
+        coro.send(None)
+    except StopIteration as done:
+        return done.value
+    raise RuntimeError("serialize_response suspended unexpectedly")
+
+
+def variants(payload, model):
+    result = {
+        "jsonable_encoder": lambda: JSONResponse(jsonable_encoder(payload)).body,
+        "orjson": lambda: ORJSONResponse(payload).body,
+    }
+    if model is not None:
+        field = create_model_field(name="response", type_=model, mode="serialization")
+        result["response_model"] = lambda: Response(
+            _run(serialize_response(field=field, response_content=payload, dump_json=True)),
+            media_type="application/json",
+        ).body
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000, help="Responses rendered per payload and variant")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for name, (payload, model, before) in payloads().items():
+        timings = {variant: time_calls(fn, args.iterations) for variant, fn in variants(payload, model).items()}
+        before_ms, after_ms = timings[before]["mean_ms"], timings["orjson"]["mean_ms"]
+        results[name] = {
+            **timings,
+            "before": before,
+            "saved_per_response_us": round((before_ms - after_ms) * 1000, 1),
+            "speedup": round(before_ms / after_ms, 1) if after_ms else None,
+        }
+
+    report = {
+        "benchmark": "serialization",
+        "environment": environment(),
+        "config": {"iterations": args.iterations},
+        "results": results,
+    }
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: how long a fresh worker takes before it can serve traffic.
+
+Each run starts a new interpreter and measures
+  import   - `import main` (module import + app construction)
+  serve    - spawn uvicorn until GET /livez answers, then until /readyz is 200
+so scale-out latency can be tracked between releases. Uses the same database
+settings as the app; defaults to a throwaway SQLite file.
+
+    python -m benchmarks.bench_startup --runs 10 --output startup.json
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from benchmarks.common import environment, summarize, write_report
+
+DEFAULT_SQLITE_PATH = "bench_startup.db"
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_import(env):
+    started = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(out.strip().splitlines()[-1]), time.perf_counter() - started
+
+
+def wait_for(url, started, timeout):
+    while time.perf_counter() - started < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - started
+        except Exception:
+            pass
+        time.sleep(0.01)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+def time_serve(env, timeout):
+    port = free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        live = wait_for(f"http://127.0.0.1:{port}/livez", started, timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/readyz", started, timeout)
+        return live, ready
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help=f"Database for the app (default: sqlite:///{DEFAULT_SQLITE_PATH})")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--skip-serve", action="store_true", help="Only measure `import main`")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for a server to become ready")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["DATABASE_URL"] = args.database_url or env.get("DATABASE_URL") or f"sqlite:///{DEFAULT_SQLITE_PATH}"
+
+    import_times, process_times, live_times, ready_times = [], [], [], []
+    for i in range(args.runs):
+        print(f"⏱️  Run {i + 1}/{args.runs}...", file=sys.stderr)
+        in_process, wall = time_import(env)
+        import_times.append(in_process)
+        process_times.append(wall)
+        if not args.skip_serve:
+            live, ready = time_serve(env, args.timeout)
+            live_times.append(live)
+            ready_times.append(ready)
+
+    results = {
+        "import_main": summarize(import_times),
+        "import_main_process": summarize(process_times),
+    }
+    if not args.skip_serve:
+        results["uvicorn_to_livez"] = summarize(live_times)
+        results["uvicorn_to_readyz"] = summarize(ready_times)
+
+    write_report({
+        "benchmark": "startup",
+        "environment": environment(),
+        "config": {
+            "runs": args.runs,
+            "database": env["DATABASE_URL"].split("@")[-1],
+            "db_async": env.get("DB_ASYNC", "false"),
+        },
+        "results": results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# bulk_import.py
+"""
+Bulk user import for tenant onboarding and identity-store migrations.
+
+Rows are read from JSONL or CSV (fields: email, username, password or
+hashed_password, is_verified), validated, hashed on a process pool and loaded
+in chunks. On PostgreSQL each chunk is COPY'd into a temporary staging table
+and moved into users with a single INSERT ... SELECT ... ON CONFLICT DO
+NOTHING, so one bad or duplicate row never aborts the batch; it is recorded in
+the report instead.
+
+Used by POST /auth/users/import (BULK_IMPORT_HTTP_WORKERS hashing processes)
+and the import_users.py CLI (BULK_IMPORT_WORKERS, all cores by default).
+"""
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from pydantic import EmailStr, TypeAdapter
+
+import auth
+from models import User, normalize_email
+
+BULK_IMPORT_CHUNK_SIZE = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", "5000"))
+BULK_IMPORT_WORKERS = int(os.getenv("BULK_IMPORT_WORKERS", str(os.cpu_count() or 1)))
+# POST /auth/users/import runs inside a web worker, next to login's bcrypt
+# pool: keep it to a couple of cores and leave full-CPU imports to the CLI
+BULK_IMPORT_HTTP_WORKERS = int(os.getenv("BULK_IMPORT_HTTP_WORKERS", str(min(2, os.cpu_count() or 1))))
+BULK_IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("BULK_IMPORT_MAX_REPORTED_ERRORS", "1000"))
+
+_email_adapter = TypeAdapter(EmailStr)
+_TRUE_VALUES = {"1", "true", "t", "yes", "y"}
+
+_STAGING_COLUMNS = ("line_no", "user_id", "email", "email_normalized", "username", "hashed_password", "is_verified")
+
+
+def iter_records(fileobj, fmt):
+    """Yield (line_no, dict) from a text file object; malformed lines yield (line_no, Exception)"""
+    if fmt == "csv":
+        reader = csv.DictReader(fileobj)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line_no, line in enumerate(fileobj, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            yield line_no, ValueError(f"invalid JSON: {e}")
+            continue
+        yield line_no, record
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in _TRUE_VALUES
+
+
+def validate_record(record):
+    """Normalize one input record; raises ValueError with a reportable message"""
+    try:
+        email = _email_adapter.validate_python((record.get("email") or "").strip())
+    except Exception:
+        raise ValueError("invalid email")
+
+    username = (record.get("username") or "").strip() or email.split("@")[0]
+    password = record.get("password") or None
+    hashed_password = record.get("hashed_password") or None
+
+    if hashed_password:
+        if auth.pwd_context.identify(hashed_password) is None:
+            raise ValueError("unsupported hashed_password format")
+    elif not password:
+        raise ValueError("password or hashed_password is required")
+
+    return {
+        "user_id": str(uuid.uuid4()),
+        "email": email,
+        "email_normalized": normalize_email(email),
+        "username": username,
+        "password": None if hashed_password else password,
+        "hashed_password": hashed_password,
+        "is_verified": _parse_bool(record.get("is_verified")),
+    }
+
+
+class BulkImporter:
+    """Accumulates validated rows and flushes them to the database chunk by chunk"""
+
+    def __init__(self, engine, chunk_size=BULK_IMPORT_CHUNK_SIZE, workers=BULK_IMPORT_WORKERS):
+        self.engine = engine
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.report = {
+            "total": 0,
+            "inserted": 0,
+            "failed": 0,
+            "errors": [],
+            "duration_seconds": 0.0,
+        }
+        self._pending = []
+        self._executor = None
+        self._started = time.perf_counter()
+
+    def __enter__(self):
+        # spawn keeps the children free of the parent's DB connections and threads
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        self._executor.shutdown(wait=True)
+        self.report["duration_seconds"] = round(time.perf_counter() - self._started, 3)
+        return False
+
+    def add_error(self, line_no, email, error):
+        self.report["failed"] += 1
+        if len(self.report["errors"]) < BULK_IMPORT_MAX_REPORTED_ERRORS:
+            self.report["errors"].append({"line": line_no, "email": email, "error": error})
+
+    def add(self, line_no, record):
+        self.report["total"] += 1
+        if isinstance(record, Exception):
+            self.add_error(line_no, None, str(record))
+            return
+        try:
+            row = validate_record(record)
+        except ValueError as e:
+            self.add_error(line_no, record.get("email"), str(e))
+            return
+        row["line_no"] = line_no
+        self._pending.append(row)
+        if len(self._pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        rows, self._pending = self._pending, []
+        if not rows:
+            return
+
+        to_hash = [row for row in rows if row["hashed_password"] is None]
+        if to_hash:
+            chunksize = max(1, len(to_hash) // (self.workers * 4))
+            hashes = self._executor.map(
+                auth.get_password_hash, [row["password"] for row in to_hash], chunksize=chunksize
+            )
+            for row, hashed in zip(to_hash, hashes):
+                row["hashed_password"] = hashed
+
+        if self.engine.dialect.name == "postgresql" and self.engine.dialect.driver == "psycopg2":
+            inserted = self._copy_chunk(rows)
+        else:
+            inserted = self._insert_chunk(rows)
+
+        self.report["inserted"] += len(inserted)
+        for row in rows:
+            if row["line_no"] not in inserted:
+                self.add_error(row["line_no"], row["email"], "email already registered")
+
+    def _copy_chunk(self, rows):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for row in rows:
+            writer.writerow([row[col] for col in _STAGING_COLUMNS])
+        buf.seek(0)
+
+        raw = self.engine.raw_connection()
+        try:
+            cur = raw.cursor()
+            cur.execute(
+                "CREATE TEMP TABLE users_import_staging ("
+                " line_no integer, user_id varchar, email varchar, email_normalized varchar, username varchar,"
+                " hashed_password varchar, is_verified boolean"
+                ") ON COMMIT DROP"
+            )
+            cur.copy_expert(
+                f"COPY users_import_staging ({', '.join(_STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                buf,
+            )
+            cur.execute(
+                "WITH ins AS ("
+                " INSERT INTO users (user_id, email, email_normalized, username, hashed_password, is_active, is_verified)"
+                " SELECT user_id, email, email_normalized, username, hashed_password, true, is_verified"
+                " FROM users_import_staging ORDER BY line_no"
+                " ON CONFLICT (email_normalized) DO NOTHING RETURNING user_id"
+                ") SELECT s.line_no FROM users_import_staging s JOIN ins ON ins.user_id = s.user_id"
+            )
+            inserted = {line_no for (line_no,) in cur.fetchall()}
+            raw.commit()
+            return inserted
+        except Exception:
+            raw.rollback()
+            raise
+        finally:
+            raw.close()
+
+    def _insert_chunk(self, rows):
+        # Portable path (SQLite benchmarks/dev): same semantics, no COPY
+        from database import dialect_insert
+
+        inserted = set()
+        with self.engine.begin() as conn:
+            for row in rows:
+                stmt = (
+                    dialect_insert(conn, User)
+                    .values(
+                        user_id=row["user_id"],
+                        email=row["email"],
+                        email_normalized=row["email_normalized"],
+                        username=row["username"],
+                        hashed_password=row["hashed_password"],
+                        is_active=True,
+                        is_verified=row["is_verified"],
+                    )
+                    .on_conflict_do_nothing(index_elements=[User.email_normalized])
+                    .returning(User.id)
+                )
+                if conn.execute(stmt).first() is not None:
+                    inserted.add(row["line_no"])
+        return inserted
+
+
+def import_users(fileobj, fmt="jsonl", engine=None, chunk_size=BULK_IMPORT_CHUNK_SIZE, workers=BULK_IMPORT_WORKERS):
+    """Import every record from a text file object and return the report"""
+    if fmt not in ("jsonl", "csv"):
+        raise ValueError("format must be 'jsonl' or 'csv'")
+    if engine is None:
+        from database import engine
+
+    with BulkImporter(engine, chunk_size=chunk_size, workers=workers) as importer:
+        for line_no, record in iter_records(fileobj, fmt):
+            importer.add(line_no, record)
+    return importer.report
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Password hashing calibration script
+Benchmarks bcrypt cost factors (and optionally argon2id time costs) on this
+host and recommends the strongest setting that stays within a per-hash budget.
+
+    python calibrate_hashing.py --target-ms 250
+    python calibrate_hashing.py --target-ms 250 --argon2 --samples 5
+
+Run it on the production instance type: the result is only valid for the CPU
+it was measured on. Per-worker login capacity is roughly 1000 / hash_ms per
+hashing thread (HASH_MAX_WORKERS).
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import auth
+
+PASSWORD = "calibration-password-123"
+
+
+def measure(context, samples):
+    """Median milliseconds per hash for a CryptContext"""
+    context.hash(PASSWORD)  # warm up
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.hash(PASSWORD)
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 1)
+
+
+def calibrate_bcrypt(target_ms, samples, min_rounds, max_rounds):
+    results = {}
+    recommended = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        ms = measure(auth.build_pwd_context("bcrypt", bcrypt_rounds=rounds), samples)
+        results[rounds] = ms
+        print(f"   bcrypt rounds={rounds:<3} {ms:>8} ms", file=sys.stderr)
+        if ms > target_ms:
+            break  # each extra round doubles the cost
+        recommended = rounds
+    return recommended, results
+
+
+def calibrate_argon2(target_ms, samples, max_time_cost):
+    from passlib.context import CryptContext
+
+    results = {}
+    recommended = 1
+    for time_cost in range(1, max_time_cost + 1):
+        context = CryptContext(
+            schemes=["argon2"],
+            argon2__type="ID",
+            argon2__time_cost=time_cost,
+            argon2__memory_cost=auth.ARGON2_MEMORY_COST_KIB,
+            argon2__parallelism=auth.ARGON2_PARALLELISM,
+        )
+        ms = measure(context, samples)
+        results[time_cost] = ms
+        print(f"   argon2id time_cost={time_cost:<3} {ms:>8} ms", file=sys.stderr)
+        if ms > target_ms:
+            break
+        recommended = time_cost
+    return recommended, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend password hashing cost factors for this host")
+    parser.add_argument("--target-ms", type=float, default=250.0, help="Budget per hash in milliseconds")
+    parser.add_argument("--samples", type=int, default=3, help="Hashes timed per setting")
+    parser.add_argument("--min-rounds", type=int, default=10, help="Lowest bcrypt cost to consider")
+    parser.add_argument("--max-rounds", type=int, default=16)
+    parser.add_argument("--argon2", action="store_true", help="Also calibrate argon2id time_cost")
+    parser.add_argument("--max-time-cost", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"🔄 Calibrating bcrypt for a {args.target_ms} ms budget...", file=sys.stderr)
+    rounds, bcrypt_results = calibrate_bcrypt(args.target_ms, args.samples, args.min_rounds, args.max_rounds)
+    report = {
+        "target_ms": args.target_ms,
+        "bcrypt_ms": bcrypt_results,
+        "recommended_env": {"BCRYPT_ROUNDS": rounds},
+        "current": {"scheme": auth.PASSWORD_HASH_SCHEME, "bcrypt_rounds": auth.BCRYPT_ROUNDS},
+    }
+
+    if args.argon2:
+        print(
+            f"🔄 Calibrating argon2id (memory {auth.ARGON2_MEMORY_COST_KIB} KiB, "
+            f"parallelism {auth.ARGON2_PARALLELISM})...",
+            file=sys.stderr,
+        )
+        time_cost, argon2_results = calibrate_argon2(args.target_ms, args.samples, args.max_time_cost)
+        report["argon2id_ms"] = argon2_results
+        report["recommended_env"]["ARGON2_TIME_COST"] = time_cost
+
+    print(json.dumps(report, indent=2))
+    if bcrypt_results[rounds] > args.target_ms:
+        print(f"⚠️  Even bcrypt rounds={rounds} exceeds {args.target_ms} ms on this host", file=sys.stderr)
+    print(
+        "✅ Recommended: " + " ".join(f"{k}={v}" for k, v in report["recommended_env"].items()),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 """
-Database table creation script for deployment
-Creates all tables defined in models.py
+One-shot schema setup: creates any missing tables defined in models.py.
+
+The app no longer touches the schema on startup. Deploys run it through
+migrate.py (the release/pre-deploy command), which also applies the data
+migrations; on its own:
+
+    python create_tables.py
 """
 import sys
+from sqlalchemy import inspect
 from database import engine, Base, test_connection
-from models import User
+import models  # ensures models are registered
 
 def create_tables():
     """Create all database tables"""
@@ -20,15 +26,12 @@ def create_tables():
         print("✅ All tables created successfully")
         
         # Verify tables were created
-        with engine.connect() as connection:
-            from sqlalchemy import text
-            result = connection.execute(text("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'"))
-            tables = [row[0] for row in result]
-            print(f"✅ Created tables: {', '.join(tables)}")
+        tables = inspect(engine).get_table_names()
+        print(f"✅ Created tables: {', '.join(tables)}")
             
     except Exception as e:
         print(f"❌ Error creating tables: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    create_tables()
\ No newline at end of file
+    create_tables()
@@ -1,11 +1,17 @@
 # database.py
 import os
 import sys
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from dotenv import load_dotenv
 
+import metrics
+import replica
+
 # Load environment variables
 load_dotenv()
 
@@ -59,20 +65,171 @@ except ValueError as e:
     # In Railway, we want to fail fast if DB config is wrong
     sys.exit(1)
 
+# ----------------------------
+# Connection pool configuration
+# DB_MAX_CONNECTIONS is the connection budget for one replica; it is split
+# across WEB_CONCURRENCY worker processes, and with DB_ASYNC=true between each
+# worker's sync and async engine (both connect to the same server), so
+# workers x pools never exceeds what Postgres/Neon allows. DB_POOL_MODE=pgbouncer hands pooling to an external
+# PgBouncer (transaction pooling) and keeps no connections in-process.
+# ----------------------------
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue").lower()  # "queue" or "pgbouncer"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "0"))  # 0 = no budget
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+
+# ----------------------------
+# Server-side prepared statements
+# The hot statements in queries.py are built once, so their SQL text is stable
+# and worth preparing. asyncpg prepares every statement and keeps the last
+# DB_PREPARED_STATEMENT_CACHE_SIZE per connection; psycopg 3
+# (postgresql+psycopg://) prepares a statement after it has run
+# DB_PREPARE_THRESHOLD times on a connection. psycopg2 has no server-side
+# prepare. Both are disabled in pgbouncer mode: a transaction-pooled server
+# connection can't keep named statements between transactions.
+# ----------------------------
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "500"))
+DB_PREPARE_THRESHOLD = int(os.getenv("DB_PREPARE_THRESHOLD", "5"))
+
+def get_pool_budget():
+    """Return (pool_size, max_overflow) for one engine in this worker process"""
+    pool_size, max_overflow = DB_POOL_SIZE, DB_MAX_OVERFLOW
+    if DB_MAX_CONNECTIONS > 0:
+        engines_per_server = 2 if DB_ASYNC else 1
+        per_worker = max(1, DB_MAX_CONNECTIONS // (WEB_CONCURRENCY * engines_per_server))
+        pool_size = min(pool_size, per_worker)
+        max_overflow = min(max_overflow, per_worker - pool_size)
+    return pool_size, max_overflow
+
+# Counters per engine, kept outside the pool objects so they survive
+# engine.dispose() (which replaces the pool).
+_pool_stats = {}
+
+def _new_pool_stats():
+    return {
+        "checkouts": 0,
+        "checkout_timeouts": 0,
+        "checkout_wait_seconds_total": 0.0,
+        "checkout_wait_seconds_max": 0.0,
+        "overflow_max": 0,
+        "connects": 0,
+        "invalidations": 0,
+        "soft_invalidations": 0,
+    }
+
+def _instrumented_pool_class(base, name):
+    """Subclass a SQLAlchemy pool so checkout wait and overflow are recorded"""
+    stats = _pool_stats.setdefault(name, _new_pool_stats())
+
+    class InstrumentedPool(base):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                conn = super()._do_get()
+            except exc.TimeoutError:
+                stats["checkout_timeouts"] += 1
+                raise
+            waited = time.perf_counter() - started
+            stats["checkouts"] += 1
+            stats["checkout_wait_seconds_total"] += waited
+            stats["checkout_wait_seconds_max"] = max(stats["checkout_wait_seconds_max"], waited)
+            stats["overflow_max"] = max(stats["overflow_max"], self.overflow())
+            metrics.DB_POOL_CHECKOUT_WAIT.observe(waited, name)
+            metrics.record_stage("pool", waited)
+            return conn
+
+    InstrumentedPool.__name__ = f"Instrumented{base.__name__}"
+    return InstrumentedPool
+
+def _instrument_engine(sync_engine, name):
+    stats = _pool_stats.setdefault(name, _new_pool_stats())
+
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        stats["connects"] += 1
+
+    @event.listens_for(sync_engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        stats["invalidations"] += 1
+
+    @event.listens_for(sync_engine, "soft_invalidate")
+    def _on_soft_invalidate(dbapi_connection, connection_record, exception):
+        stats["soft_invalidations"] += 1
+
+def get_pool_kwargs(base_pool_class, name):
+    """Pool arguments for create_engine / create_async_engine"""
+    if DB_POOL_MODE == "pgbouncer":
+        # PgBouncer owns the pooling; opening a connection per checkout is cheap
+        return {"poolclass": NullPool}
+    pool_size, max_overflow = get_pool_budget()
+    return {
+        "poolclass": _instrumented_pool_class(base_pool_class, name),
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,  # Verify connections before use
+        "pool_recycle": DB_POOL_RECYCLE,    # Recycle connections periodically
+    }
+
+def get_pool_stats():
+    """Pool status and counters for every engine created in this process"""
+    engines = {"primary": engine}
+    if async_engine is not None:
+        engines["async"] = async_engine
+    if replica_engine is not None:
+        engines["replica"] = replica_engine
+    if async_replica_engine is not None:
+        engines["async_replica"] = async_replica_engine
+    result = {}
+    for name, eng in engines.items():
+        pool = eng.pool
+        entry = {"mode": DB_POOL_MODE, "class": type(pool).__name__}
+        if hasattr(pool, "size"):
+            entry.update({
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+            })
+        entry.update(_pool_stats.get(name, {}))
+        result[name] = entry
+    return result
+
+# SQLite is only supported as a local fallback (benchmarks, quick experiments)
+IS_SQLITE = make_url(DATABASE_URL).get_backend_name() == "sqlite"
+
+def get_ssl_mode(database_url):
+    return "disable" if "localhost" in database_url or "credential-db" in database_url else "require"
+
+SSL_MODE = get_ssl_mode(DATABASE_URL)
+
+def get_connect_args(database_url):
+    """DBAPI connect() arguments for the sync engine"""
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite":
+        return {"check_same_thread": False}
+    connect_args = {"sslmode": get_ssl_mode(database_url)}
+    if url.get_driver_name() == "psycopg":
+        # None turns psycopg 3's automatic preparing off
+        connect_args["prepare_threshold"] = None if DB_POOL_MODE == "pgbouncer" else DB_PREPARE_THRESHOLD
+    return connect_args
+
 # Create engine with connection pooling optimized for Railway
 try:
     engine = create_engine(
         DATABASE_URL,
-        pool_size=5,
-        max_overflow=10,
-        pool_pre_ping=True,  # Verify connections before use
-        pool_recycle=3600,   # Recycle connections every hour
         echo=False,          # Set to True for SQL debugging
-        connect_args={
-            "sslmode": "disable" if "localhost" in DATABASE_URL or "credential-db" in DATABASE_URL else "require",
-        }
+        connect_args=get_connect_args(DATABASE_URL),
+        **get_pool_kwargs(QueuePool, "primary"),
     )
-    print("✅ Database engine created successfully")
+    _instrument_engine(engine, "primary")
+    metrics.instrument_engine(engine, "primary")
+    print(f"✅ Database engine created successfully (pool mode: {DB_POOL_MODE}, pool_size/max_overflow: {get_pool_budget()})")
 except Exception as e:
     print(f"❌ Failed to create database engine: {e}")
     sys.exit(1)
@@ -80,6 +237,143 @@ except Exception as e:
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+def dialect_insert(bind, table):
+    """INSERT construct for the bind's dialect, exposing ON CONFLICT support"""
+    if bind.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(table)
+
+# ----------------------------
+# Optional async engine (DB_ASYNC=true)
+# Serves the async auth router through asyncpg so in-flight requests don't each
+# hold a threadpool slot, including while they wait on the hashing pool (the
+# sync router blocks a slot for the whole bcrypt call). The sync engine above
+# stays live alongside it: it serves routes/users.py, the background jobs
+# (token sweeps, audit writes, rehashes) and migrate.py.
+# ----------------------------
+
+def get_async_database_url(database_url):
+    """Translate a libpq-style URL into its asyncpg equivalent"""
+    url = make_url(database_url)
+    if url.drivername in ("postgres", "postgresql", "postgresql+psycopg2"):
+        # asyncpg takes SSL settings via connect_args, not libpq query params
+        url = url.set(drivername="postgresql+asyncpg").difference_update_query(
+            ["sslmode", "channel_binding"]
+        )
+        # Transaction pooling can't keep named prepared statements alive
+        cache_size = 0 if DB_POOL_MODE == "pgbouncer" else DB_PREPARED_STATEMENT_CACHE_SIZE
+        url = url.update_query_dict({"prepared_statement_cache_size": str(cache_size)})
+    elif url.drivername in ("sqlite", "sqlite+pysqlite"):
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url
+
+def get_async_connect_args(database_url):
+    if make_url(database_url).get_backend_name() == "sqlite":
+        return {}
+    connect_args = {"ssl": get_ssl_mode(database_url)}
+    if DB_POOL_MODE == "pgbouncer":
+        connect_args["statement_cache_size"] = 0
+    return connect_args
+
+async_engine = None
+AsyncSessionLocal = None
+
+if DB_ASYNC:
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        async_engine = create_async_engine(
+            get_async_database_url(DATABASE_URL),
+            echo=False,
+            connect_args=get_async_connect_args(DATABASE_URL),
+            **get_pool_kwargs(AsyncAdaptedQueuePool, "async"),
+        )
+        _instrument_engine(async_engine.sync_engine, "async")
+        metrics.instrument_engine(async_engine.sync_engine, "async")
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+        print("✅ Async database engine created successfully")
+    except Exception as e:
+        print(f"❌ Failed to create async database engine: {e}")
+        sys.exit(1)
+
+# ----------------------------
+# Optional read replica (DATABASE_REPLICA_URL)
+# Read-only endpoints open ReadSessionLocal / AsyncReadSessionLocal, whose
+# RoutingSession sends reads to the replica while replica.is_usable() and
+# everything else to the primary; see replica.py for lag and read-your-writes.
+# The replica gets its own pool with the same per-worker budget, so lookup
+# traffic scales with replicas instead of primary connections.
+# ----------------------------
+class RoutingSession(Session):
+    """Session whose bind is chosen per statement from info["primary"] / info["replica"]"""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        is_write = (
+            self._flushing
+            or getattr(clause, "is_dml", False)
+            or getattr(clause, "_for_update_arg", None) is not None
+        )
+        target = replica.choose(self.info, is_write)
+        self.info["bind"] = target
+        return self.info[target]
+
+replica_engine = None
+async_replica_engine = None
+ReadSessionLocal = SessionLocal
+AsyncReadSessionLocal = AsyncSessionLocal
+
+if replica.DATABASE_REPLICA_URL:
+    try:
+        replica_engine = create_engine(
+            replica.DATABASE_REPLICA_URL,
+            echo=False,
+            connect_args=get_connect_args(replica.DATABASE_REPLICA_URL),
+            **get_pool_kwargs(QueuePool, "replica"),
+        )
+        _instrument_engine(replica_engine, "replica")
+        metrics.instrument_engine(replica_engine, "replica")
+        ReadSessionLocal = sessionmaker(
+            class_=RoutingSession,
+            autoflush=False,
+            info={"routing": True, "primary": engine, "replica": replica_engine},
+        )
+        if DB_ASYNC:
+            async_replica_engine = create_async_engine(
+                get_async_database_url(replica.DATABASE_REPLICA_URL),
+                echo=False,
+                connect_args=get_async_connect_args(replica.DATABASE_REPLICA_URL),
+                **get_pool_kwargs(AsyncAdaptedQueuePool, "async_replica"),
+            )
+            _instrument_engine(async_replica_engine.sync_engine, "async_replica")
+            metrics.instrument_engine(async_replica_engine.sync_engine, "async_replica")
+            AsyncReadSessionLocal = async_sessionmaker(
+                sync_session_class=RoutingSession,
+                autoflush=False,
+                expire_on_commit=False,
+                info={
+                    "routing": True,
+                    "primary": async_engine.sync_engine,
+                    "replica": async_replica_engine.sync_engine,
+                },
+            )
+        print(f"✅ Read replica engine created (max lag {replica.DB_REPLICA_MAX_LAG_SECONDS}s)")
+    except Exception as e:
+        print(f"❌ Failed to create read replica engine: {e}")
+        sys.exit(1)
+
+def reset_pools_after_fork():
+    """Drop pooled connections inherited from a parent process without closing them.
+
+    Called in each gunicorn worker right after fork (gunicorn.conf.py). With
+    preload_app the engines are created in the master; a socket it opened
+    must never be shared with, or closed from, a worker.
+    """
+    for pooled in (engine, async_engine, replica_engine, async_replica_engine):
+        if pooled is not None:
+            getattr(pooled, "sync_engine", pooled).dispose(close=False)
+
 # Test database connection with retry logic
 def test_connection(max_retries=3):
     """Test database connection with retry logic for Railway startup"""
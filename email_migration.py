@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# email_migration.py
+"""
+Case-insensitive email: adds and fills users.email_normalized.
+
+Every lookup matches on email_normalized (see models.normalize_email), which
+has a unique index, so `Foo@x.com` and `foo@x.com` resolve to one account
+with a single index probe. Existing databases are migrated in four
+idempotent steps, each in small batches so the table is never locked for
+long:
+
+  1. add the nullable column (instant on PostgreSQL)
+  2. backfill it in id order, BATCH rows per transaction
+  3. dedup case variants: the verified (then oldest) account keeps the
+     address, the others get an unmatchable "<email>#dup<id>" key and are
+     listed in the report for a manual merge
+  4. build the unique index (CONCURRENTLY on PostgreSQL) and the small
+     partial index on rows still waiting for a backfill
+
+Run it before deploying the code that reads the column:
+
+    python email_migration.py --batch-size 5000 --report dedup.json
+
+Rows inserted by old workers during the rollout are picked up by the app's
+background backfill job, which stops itself once nothing is left.
+"""
+import argparse
+import json
+import sys
+
+from sqlalchemy import bindparam, func, inspect, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+from models import User, normalize_email
+
+EMAIL_BACKFILL_BATCH_SIZE = 5000
+
+_backfill_stmt = (
+    update(User)
+    .where(User.id == bindparam("pk"), User.email_normalized.is_(None))
+    .values(email_normalized=bindparam("normalized"), updated_at=User.updated_at)
+)
+
+_rename_stmt = (
+    update(User)
+    .where(User.id == bindparam("pk"))
+    .values(email_normalized=bindparam("normalized"), updated_at=User.updated_at)
+)
+
+
+def _dup_key(normalized, pk):
+    # Not a valid address, so no lookup can ever match it
+    return f"{normalized}#dup{pk}"
+
+
+def add_column(engine):
+    if "email_normalized" in {c["name"] for c in inspect(engine).get_columns("users")}:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE users ADD COLUMN email_normalized VARCHAR"))
+    return True
+
+
+def backfill(engine, batch_size=EMAIL_BACKFILL_BATCH_SIZE):
+    """Fill email_normalized where it is NULL; returns (rows filled, rows given a dup key).
+
+    Once the unique index exists, a row that collides with an existing
+    account (old code inserted a case variant) gets a dup key instead.
+    """
+    filled = conflicts = 0
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(User.id, User.email)
+                .where(User.id > last_id, User.email_normalized.is_(None))
+                .order_by(User.id)
+                .limit(batch_size)
+            ).all()
+        if not rows:
+            return filled, conflicts
+        last_id = rows[-1].id
+        params = [{"pk": row.id, "normalized": normalize_email(row.email)} for row in rows]
+        try:
+            with engine.begin() as conn:
+                conn.execute(_backfill_stmt, params)
+            filled += len(params)
+        except IntegrityError:
+            for param in params:
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(_backfill_stmt, [param])
+                except IntegrityError:
+                    with engine.begin() as conn:
+                        conn.execute(_backfill_stmt, [{**param, "normalized": _dup_key(param["normalized"], param["pk"])}])
+                    conflicts += 1
+                    print(f"⚠️  {param['normalized']} already registered; user id {param['pk']} needs a manual merge")
+                filled += 1
+
+
+def dedup(engine, batch_size=1000):
+    """Resolve case-variant duplicates; returns [{"email", "kept_id", "renamed_ids"}]"""
+    resolved = []
+    while True:
+        with engine.begin() as conn:
+            groups = conn.execute(
+                select(User.email_normalized)
+                .where(User.email_normalized.is_not(None))
+                .group_by(User.email_normalized)
+                .having(func.count() > 1)
+                .limit(batch_size)
+            ).scalars().all()
+            if not groups:
+                return resolved
+            for normalized in groups:
+                ids = conn.execute(
+                    select(User.id)
+                    .where(User.email_normalized == normalized)
+                    .order_by(User.is_verified.desc(), User.id)
+                ).scalars().all()
+                conn.execute(
+                    _rename_stmt,
+                    [{"pk": pk, "normalized": _dup_key(normalized, pk)} for pk in ids[1:]],
+                )
+                resolved.append({"email": normalized, "kept_id": ids[0], "renamed_ids": ids[1:]})
+
+
+def create_indexes(engine):
+    """Unique lookup index plus the partial index used by the background backfill"""
+    statements = [
+        ("ix_users_email_normalized", "CREATE UNIQUE INDEX {concurrently} IF NOT EXISTS ix_users_email_normalized ON users (email_normalized)"),
+        ("ix_users_email_unnormalized", "CREATE INDEX {concurrently} IF NOT EXISTS ix_users_email_unnormalized ON users (id) WHERE email_normalized IS NULL"),
+    ]
+    postgres = engine.dialect.name == "postgresql"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, ddl in statements:
+            if postgres:
+                # A failed CONCURRENTLY build leaves an INVALID index that IF NOT EXISTS would keep
+                invalid = conn.execute(
+                    text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+                    {"name": name},
+                ).scalar()
+                if invalid:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+            conn.execute(text(ddl.format(concurrently="CONCURRENTLY" if postgres else "")))
+
+
+def migrate(engine, batch_size=EMAIL_BACKFILL_BATCH_SIZE):
+    report = {"column_added": add_column(engine)}
+    print("🔄 Backfilling email_normalized...", file=sys.stderr)
+    report["backfilled"], report["backfill_conflicts"] = backfill(engine, batch_size)
+    print("🔄 Resolving case-variant duplicates...", file=sys.stderr)
+    report["duplicates"] = dedup(engine)
+    print("🔄 Creating indexes...", file=sys.stderr)
+    create_indexes(engine)
+    return report
+
+
+def backfill_job():
+    """Scheduled job: fill rows written by pre-migration workers, then unschedule"""
+    import jobs
+    from database import engine
+
+    filled, conflicts = backfill(engine)
+    if filled:
+        print(f"🧹 Normalized {filled} user emails ({conflicts} need a manual merge)")
+        return None
+    return jobs.STOP
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=EMAIL_BACKFILL_BATCH_SIZE)
+    parser.add_argument("--report", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    from database import engine
+
+    report = migrate(engine, args.batch_size)
+    output = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    print(
+        f"✅ Backfilled {report['backfilled']} users; {len(report['duplicates'])} duplicate addresses resolved",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -12,29 +12,14 @@ fi
 
 echo "✅ DATABASE_URL is configured"
 
-# Test database connection and create tables
-echo "🔧 Setting up database..."
-python - <<'EOF'
-try:
-    from database import engine, Base, test_connection
-    import models
-    
-    print("Testing database connection...")
-    if test_connection():
-        print("Creating/verifying database tables...")
-        Base.metadata.create_all(bind=engine)
-        print("✅ Database setup completed successfully")
-    else:
-        print("❌ Database connection failed")
-        exit(1)
-except Exception as e:
-    print(f"❌ Database setup error: {e}")
-    exit(1)
-EOF
-
-if [ $? -ne 0 ]; then
-    echo "❌ Database setup failed"
-    exit 1
+# Migrations are opt-in here: Railway runs migrate.py as its pre-deploy
+# command. Set DB_CREATE_SCHEMA=true where no release step exists.
+if [ "$DB_CREATE_SCHEMA" = "true" ]; then
+    echo "🔧 Setting up database..."
+    if ! python migrate.py; then
+        echo "❌ Database setup failed"
+        exit 1
+    fi
 fi
 
 echo "🎉 Starting FastAPI application..."
@@ -43,4 +28,4 @@ echo "🎉 Starting FastAPI application..."
 export PORT=${PORT:-8000}
 
 # Start the application
-exec uvicorn main:app --host 0.0.0.0 --port $PORT
+exec gunicorn -c gunicorn.conf.py main:app
@@ -0,0 +1,158 @@
+# gunicorn.conf.py
+"""
+Production server profile: `gunicorn -c gunicorn.conf.py main:app`.
+
+gunicorn manages a pool of UvicornWorker processes, each running the ASGI app on
+uvloop with the httptools parser. The app is imported once in the master
+(preload_app), so FastAPI, SQLAlchemy, passlib and the bcrypt backend are
+loaded before fork. Workers start in milliseconds and share those pages
+copy-on-write. A worker restarted by max_requests does not pay the import again.
+
+Workers: WEB_CONCURRENCY if set, otherwise WEB_WORKERS_PER_CORE per usable core
+(cgroup CPU quota aware), capped by the container's memory at
+WEB_WORKER_MEMORY_MB per worker. The result is exported as WEB_CONCURRENCY
+before the app loads, so database.get_pool_budget() splits DB_MAX_CONNECTIONS
+across the real number of workers. Unless set, HASH_MAX_WORKERS is exported the
+same way as the usable cores divided by the workers, so the per-worker bcrypt
+pools together never outnumber the cores the container may use.
+
+Shutdown: on SIGTERM each worker stops accepting connections, finishes in-flight
+requests, then runs the app lifespan shutdown (flush deferred writes, close the
+DB pools). WEB_GRACEFUL_TIMEOUT_SECONDS bounds how long that may take.
+"""
+import math
+import os
+import sys
+
+from uvicorn.workers import UvicornWorker
+
+PORT = os.getenv("PORT", "8000")
+WEB_WORKERS_PER_CORE = float(os.getenv("WEB_WORKERS_PER_CORE", "1"))
+WEB_WORKER_MEMORY_MB = int(os.getenv("WEB_WORKER_MEMORY_MB", "256"))
+WEB_MIN_WORKERS = int(os.getenv("WEB_MIN_WORKERS", "2"))
+WEB_KEEPALIVE_SECONDS = int(os.getenv("WEB_KEEPALIVE_SECONDS", "75"))
+WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "10000"))
+WEB_MAX_REQUESTS_JITTER = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "1000"))
+WEB_TIMEOUT_SECONDS = int(os.getenv("WEB_TIMEOUT_SECONDS", "60"))
+WEB_GRACEFUL_TIMEOUT_SECONDS = int(os.getenv("WEB_GRACEFUL_TIMEOUT_SECONDS", "30"))
+WEB_PRELOAD = os.getenv("WEB_PRELOAD", "true").lower() == "true"
+# Peers whose X-Forwarded-For/-Proto uvicorn believes. The platform edge
+# proxy connects from a private address; uvicorn walks X-Forwarded-For from the
+# right past these and takes the first public hop as request.client. Never "*":
+# that trusts the leftmost, client-supplied entry.
+FORWARDED_ALLOW_IPS = os.getenv(
+    "FORWARDED_ALLOW_IPS", "127.0.0.1,::1,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,100.64.0.0/10,fc00::/7"
+)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def usable_cores():
+    """CPUs this process may run on, limited by a cgroup CPU quota (containers)"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    quota, period = None, None
+    cpu_max = _read("/sys/fs/cgroup/cpu.max")  # cgroup v2: "<quota|max> <period>"
+    if cpu_max:
+        value, _, period_value = cpu_max.partition(" ")
+        if value != "max":
+            quota, period = int(value), int(period_value)
+    else:  # cgroup v1: quota is -1 when unlimited
+        quota_value = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period_value = _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if quota_value and period_value and int(quota_value) > 0:
+            quota, period = int(quota_value), int(period_value)
+    if quota and period:
+        cores = min(cores, max(1, math.ceil(quota / period)))
+    return cores
+
+
+def memory_limit_mb():
+    """Memory available to this container (cgroup limit) or host, in MB"""
+    physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2**20
+    limit = _read("/sys/fs/cgroup/memory.max") or _read("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    if limit and limit.isdigit():
+        # cgroup v1 reports "unlimited" as a huge number
+        return min(physical, int(limit) // 2**20)
+    return physical
+
+
+def compute_workers():
+    if os.getenv("WEB_CONCURRENCY"):
+        return max(1, int(os.environ["WEB_CONCURRENCY"]))
+    # Each worker is one event loop; bcrypt runs off-loop in the hashing pool,
+    # so one worker per core keeps every core busy without oversubscribing
+    by_cpu = max(WEB_MIN_WORKERS, math.ceil(usable_cores() * WEB_WORKERS_PER_CORE))
+    by_memory = max(1, memory_limit_mb() // WEB_WORKER_MEMORY_MB)
+    return min(by_cpu, by_memory)
+
+
+class AppUvicornWorker(UvicornWorker):
+    # Explicit instead of "auto", so a missing extra fails loudly rather than
+    # silently falling back to asyncio and h11
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}
+
+
+# ----------------------------
+# Server settings (gunicorn reads these module-level names)
+# ----------------------------
+workers = compute_workers()
+os.environ["WEB_CONCURRENCY"] = str(workers)  # read by database.py at import
+# read by hashing.py at import; its own default (os.cpu_count) sees host CPUs
+os.environ.setdefault("HASH_MAX_WORKERS", str(max(1, usable_cores() // workers)))
+
+worker_class = AppUvicornWorker
+bind = f"0.0.0.0:{PORT}"
+preload_app = WEB_PRELOAD
+
+# Longer than the load balancer's idle timeout, so the proxy closes idle
+# connections first and never reuses one the worker has just dropped
+keepalive = WEB_KEEPALIVE_SECONDS
+
+# Recycle workers to bound slow memory growth; the jitter keeps them from
+# restarting all at once
+max_requests = WEB_MAX_REQUESTS
+max_requests_jitter = WEB_MAX_REQUESTS_JITTER
+
+timeout = WEB_TIMEOUT_SECONDS
+graceful_timeout = WEB_GRACEFUL_TIMEOUT_SECONDS
+
+# Heartbeat files on tmpfs: a disk-backed /tmp in containers can stall workers
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+forwarded_allow_ips = FORWARDED_ALLOW_IPS
+
+accesslog = "-"
+errorlog = "-"
+
+
+# ----------------------------
+# Hooks
+# ----------------------------
+def when_ready(server):
+    """Master, after the preloaded app is imported: load the password hash backends
+    too, so no worker pays for backend detection on its first login"""
+    auth = sys.modules.get("auth")
+    if auth is not None:
+        for scheme in auth.pwd_context.schemes():
+            auth.pwd_context.handler(scheme).get_backend()
+    print(
+        f"🚀 gunicorn: {workers} workers ({usable_cores()} cores, {memory_limit_mb()} MB), "
+        f"preload={'on' if preload_app else 'off'}, max_requests={max_requests} (+0..{max_requests_jitter})"
+    )
+
+
+def post_fork(server, worker):
+    """Worker, right after fork: forget DB connections inherited from the master"""
+    database = sys.modules.get("database")
+    if database is not None:
+        database.reset_pools_after_fork()
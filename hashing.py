@@ -0,0 +1,208 @@
+# hashing.py
+"""
+Bounded executor for bcrypt work.
+
+Password hashing and verification are CPU-heavy (~100-250 ms each), so they run
+on a dedicated pool instead of inline in the request threadpool. The pool has a
+fixed concurrency cap and a queue-depth limit: once both are exhausted new work
+is rejected with HashingOverloaded so the API can shed load (503 + Retry-After)
+instead of letting latency grow without bound.
+
+bcrypt releases the GIL, so a thread pool is the default. Set
+HASH_EXECUTOR=process to use a process pool instead.
+
+Only the awaitable API (DB_ASYNC=true, routes/auth_async.py) frees the caller
+while a hash runs. The blocking API used by the sync router holds one of the
+request threadpool's REQUEST_THREADPOOL_SIZE threads per waiting request, so
+it sheds at half that size: past it, requests would queue for a thread before
+ever reaching this pool and the 503 could not fire.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import auth
+import metrics
+
+HASH_EXECUTOR = os.getenv("HASH_EXECUTOR", "thread").lower()  # "thread" or "process"
+HASH_MAX_WORKERS = int(os.getenv("HASH_MAX_WORKERS", str(os.cpu_count() or 1)))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "64"))
+HASH_RETRY_AFTER_SECONDS = int(os.getenv("HASH_RETRY_AFTER_SECONDS", "1"))
+# Threads anyio runs sync route handlers on (applied by main.lifespan)
+REQUEST_THREADPOOL_SIZE = int(os.getenv("REQUEST_THREADPOOL_SIZE", "40"))
+
+# Hashes running or queued before new work is rejected
+MAX_IN_FLIGHT = HASH_MAX_WORKERS + HASH_QUEUE_LIMIT
+BLOCKING_MAX_IN_FLIGHT = max(1, min(MAX_IN_FLIGHT, REQUEST_THREADPOOL_SIZE // 2))
+
+
+class HashingOverloaded(Exception):
+    """Raised when the hashing pool and its queue are full."""
+
+    def __init__(self, retry_after=HASH_RETRY_AFTER_SECONDS):
+        super().__init__("Password hashing capacity exceeded")
+        self.retry_after = retry_after
+
+
+_executor = None
+_lock = threading.Lock()
+_in_flight = 0
+_stats = {
+    "submitted": 0,
+    "completed": 0,
+    "rejected": 0,
+    "failed": 0,
+    "queue_wait_seconds_total": 0.0,
+    "queue_wait_seconds_max": 0.0,
+    "hash_seconds_total": 0.0,
+    "hash_seconds_max": 0.0,
+}
+
+
+def _get_executor():
+    """Create the executor lazily so importing this module never forks or spawns threads."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                if HASH_EXECUTOR == "process":
+                    _executor = ProcessPoolExecutor(max_workers=HASH_MAX_WORKERS)
+                else:
+                    _executor = ThreadPoolExecutor(
+                        max_workers=HASH_MAX_WORKERS, thread_name_prefix="hashing"
+                    )
+    return _executor
+
+
+def _timed_call(fn, submitted_at, *args):
+    # Runs inside the worker; wall-clock time is used so the timestamps stay
+    # comparable when the worker is a separate process.
+    started_at = time.time()
+    result = fn(*args)
+    return result, started_at - submitted_at, time.time() - started_at
+
+
+def _submit(limit, fn, *args):
+    global _in_flight
+    with _lock:
+        if _in_flight >= limit:
+            _stats["rejected"] += 1
+            raise HashingOverloaded()
+        _in_flight += 1
+        _stats["submitted"] += 1
+
+    try:
+        future = _get_executor().submit(_timed_call, fn, time.time(), *args)
+    except Exception:
+        with _lock:
+            _in_flight -= 1
+            _stats["failed"] += 1
+        raise
+    future.add_done_callback(_record)
+    return future
+
+
+def _record(future):
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+        if future.cancelled() or future.exception() is not None:
+            _stats["failed"] += 1
+            return
+        _, queue_wait, hash_time = future.result()
+        _stats["completed"] += 1
+        _stats["queue_wait_seconds_total"] += queue_wait
+        _stats["queue_wait_seconds_max"] = max(_stats["queue_wait_seconds_max"], queue_wait)
+        _stats["hash_seconds_total"] += hash_time
+        _stats["hash_seconds_max"] = max(_stats["hash_seconds_max"], hash_time)
+
+
+def _observe(operation, started):
+    elapsed = time.perf_counter() - started
+    metrics.HASH_LATENCY.observe(elapsed, operation)
+    metrics.record_stage("hash", elapsed)
+
+
+# ----------------------------
+# Blocking API (sync route handlers)
+# The calling threadpool thread waits on .result(), so these shed at
+# BLOCKING_MAX_IN_FLIGHT to leave request threads for other endpoints.
+# ----------------------------
+def hash_password(password):
+    started = time.perf_counter()
+    result, _, _ = _submit(BLOCKING_MAX_IN_FLIGHT, auth.get_password_hash, password).result()
+    _observe("hash", started)
+    return result
+
+
+def verify_password(plain_password, hashed_password):
+    started = time.perf_counter()
+    result, _, _ = _submit(
+        BLOCKING_MAX_IN_FLIGHT, auth.verify_password, plain_password, hashed_password
+    ).result()
+    _observe("verify", started)
+    return result
+
+
+def verify_and_update(plain_password, hashed_password):
+    """(ok, new_hash_or_None); see auth.verify_and_update"""
+    started = time.perf_counter()
+    result, _, _ = _submit(
+        BLOCKING_MAX_IN_FLIGHT, auth.verify_and_update, plain_password, hashed_password
+    ).result()
+    _observe("verify", started)
+    return result
+
+
+# ----------------------------
+# Awaitable API (async route handlers)
+# ----------------------------
+async def ahash_password(password):
+    started = time.perf_counter()
+    result, _, _ = await asyncio.wrap_future(_submit(MAX_IN_FLIGHT, auth.get_password_hash, password))
+    _observe("hash", started)
+    return result
+
+
+async def averify_password(plain_password, hashed_password):
+    started = time.perf_counter()
+    result, _, _ = await asyncio.wrap_future(
+        _submit(MAX_IN_FLIGHT, auth.verify_password, plain_password, hashed_password)
+    )
+    _observe("verify", started)
+    return result
+
+
+async def averify_and_update(plain_password, hashed_password):
+    started = time.perf_counter()
+    result, _, _ = await asyncio.wrap_future(
+        _submit(MAX_IN_FLIGHT, auth.verify_and_update, plain_password, hashed_password)
+    )
+    _observe("verify", started)
+    return result
+
+
+def get_stats():
+    """Snapshot of pool configuration, current load and cumulative timings."""
+    with _lock:
+        stats = dict(_stats)
+        stats["in_flight"] = _in_flight
+    stats["executor"] = HASH_EXECUTOR
+    stats["max_workers"] = HASH_MAX_WORKERS
+    stats["queue_limit"] = HASH_QUEUE_LIMIT
+    stats["max_in_flight"] = MAX_IN_FLIGHT
+    stats["blocking_max_in_flight"] = BLOCKING_MAX_IN_FLIGHT
+    completed = stats["completed"] or 1
+    stats["queue_wait_seconds_avg"] = stats["queue_wait_seconds_total"] / completed
+    stats["hash_seconds_avg"] = stats["hash_seconds_total"] / completed
+    return stats
+
+
+def shutdown(wait=True):
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
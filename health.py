@@ -0,0 +1,69 @@
+# health.py
+"""
+Liveness and readiness state.
+
+/livez does no I/O. /readyz and /health serve the database status cached by a
+background probe job, which runs one SELECT 1 per interval in a worker thread
+and never retries inline; a failed probe is simply reported until the next one
+succeeds. Probe requests therefore cost a dict copy instead of a round trip.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import text
+
+HEALTH_PROBE_INTERVAL_SECONDS = float(os.getenv("HEALTH_PROBE_INTERVAL_SECONDS", "5"))
+# A status older than this is treated as unknown (e.g. the prober is stuck)
+HEALTH_PROBE_MAX_AGE_SECONDS = float(
+    os.getenv("HEALTH_PROBE_MAX_AGE_SECONDS", str(HEALTH_PROBE_INTERVAL_SECONDS * 3))
+)
+
+_lock = threading.Lock()
+_status = {
+    "ok": None,  # None until the first probe completes
+    "checked_at": None,
+    "latency_ms": None,
+    "error": None,
+    "consecutive_failures": 0,
+}
+
+
+def probe_database(engine=None):
+    """Run a single SELECT 1 and record the outcome; returns True when the database answered"""
+    if engine is None:
+        from database import engine
+
+    started = time.perf_counter()
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        ok, error = True, None
+    except Exception as e:
+        ok, error = False, f"{type(e).__name__}: {e}"[:200]
+
+    with _lock:
+        _status["ok"] = ok
+        _status["checked_at"] = time.time()
+        _status["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        _status["error"] = error
+        _status["consecutive_failures"] = 0 if ok else _status["consecutive_failures"] + 1
+    return ok
+
+
+def get_status():
+    """Cached database status; ok is False when the last probe failed or is too old"""
+    with _lock:
+        status = dict(_status)
+    checked_at = status["checked_at"]
+    status["age_seconds"] = round(time.time() - checked_at, 3) if checked_at else None
+    if status["ok"] and status["age_seconds"] > HEALTH_PROBE_MAX_AGE_SECONDS:
+        status["ok"] = False
+        status["error"] = "stale probe result"
+    return status
+
+
+def run_probe():
+    """Scheduled job: probe once and log the first failure of a streak"""
+    if not probe_database() and _status["consecutive_failures"] == 1:
+        print(f"❌ Database readiness probe failed: {_status['error']}")
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Bulk user import script
+Loads users from a JSONL or CSV file (or stdin) and prints a JSON report.
+
+    python import_users.py users.jsonl
+    python import_users.py users.csv --format csv --report report.json
+"""
+import argparse
+import json
+import sys
+
+import bulk_import
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import users into the credential service")
+    parser.add_argument("path", help="JSONL/CSV file to import, or - for stdin")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Input format (default: from file extension)")
+    parser.add_argument("--chunk-size", type=int, default=bulk_import.BULK_IMPORT_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=bulk_import.BULK_IMPORT_WORKERS, help="Hashing processes")
+    parser.add_argument("--report", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "jsonl")
+
+    print(f"🔄 Importing users from {args.path} ({fmt})...", file=sys.stderr)
+    if args.path == "-":
+        report = bulk_import.import_users(sys.stdin, fmt, chunk_size=args.chunk_size, workers=args.workers)
+    else:
+        with open(args.path, encoding="utf-8", newline="") as f:
+            report = bulk_import.import_users(f, fmt, chunk_size=args.chunk_size, workers=args.workers)
+
+    output = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    print(
+        f"✅ Imported {report['inserted']}/{report['total']} users "
+        f"({report['failed']} failed) in {report['duration_seconds']}s",
+        file=sys.stderr,
+    )
+    sys.exit(1 if report["failed"] and not report["inserted"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+# jobs.py
+"""
+In-process background jobs: a scheduler, a bounded job queue and coalesced
+deferred writes.
+
+Request handlers never do housekeeping inline; they enqueue. Periodic jobs
+are registered with every() and, once start() runs from the app lifespan,
+one scheduler task per job submits it on its interval. JOB_WORKERS worker
+tasks drain the queue and run each job (a plain sync function using the sync
+engine) in a worker thread.
+
+Jobs are keyed by name. Submitting a name that is already queued is a no-op,
+so a slow sweep or a burst of flush requests collapses into one run instead
+of piling up, and the queue never holds more than JOB_QUEUE_LIMIT jobs;
+beyond that submissions are dropped and counted.
+
+WriteBuffer collects deferred row writes keyed by primary key, keeps one
+entry per key, and writes them in a single batch on its flush interval (or
+as soon as it holds flush_at entries). EventBuffer does the same for
+append-only rows (audit events) that must not be coalesced. Buffers are
+flushed once more on shutdown, so a clean stop loses no deferred write.
+
+Everything here is per worker process. Sweeps lock their batches with
+FOR UPDATE SKIP LOCKED, so workers and replicas split the work rather than
+contend for it.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "100"))
+# How long shutdown waits for the final buffer flushes
+JOB_DRAIN_TIMEOUT_SECONDS = float(os.getenv("JOB_DRAIN_TIMEOUT_SECONDS", "10"))
+
+# Returned by a periodic job to unschedule itself (e.g. a one-off backfill that is done)
+STOP = object()
+
+Periodic = namedtuple("Periodic", ["interval", "fn", "queued", "run_at_start"])
+
+_lock = threading.Lock()
+_queue = OrderedDict()  # name -> fn, FIFO, at most one entry per name
+_periodic = {}  # name -> Periodic
+_buffers = []
+_schedulers = {}  # name -> scheduler task
+_workers = []
+_loop = None
+_wakeup = None
+_stats = {"submitted": 0, "coalesced": 0, "dropped": 0, "completed": 0, "failed": 0}
+_job_stats = {}  # name -> {"runs", "failures", "last_duration_ms", "last_error"}
+
+
+def every(name, interval, fn, queued=True, run_at_start=False):
+    """Run fn every interval seconds once the scheduler starts.
+
+    queued=False runs the job from its own scheduler task instead of the
+    shared queue, for short jobs that must not wait behind a long sweep.
+    """
+    _periodic[name] = Periodic(interval, fn, queued, run_at_start)
+
+
+def submit(name, fn):
+    """Queue fn to run in the background; returns False if the queue is full"""
+    with _lock:
+        if name in _queue:
+            _stats["coalesced"] += 1
+            return True
+        if len(_queue) >= JOB_QUEUE_LIMIT:
+            _stats["dropped"] += 1
+            return False
+        _queue[name] = fn
+        _stats["submitted"] += 1
+    _notify()
+    return True
+
+
+def _notify():
+    loop, wakeup = _loop, _wakeup
+    if loop is None:
+        return  # not started (CLI scripts, tests): the job waits for start()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        wakeup.set()
+    else:
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:
+            pass  # loop already closed during shutdown
+
+
+def _pop():
+    with _lock:
+        if not _queue:
+            return None
+        return _queue.popitem(last=False)
+
+
+async def _run(name, fn):
+    started = time.perf_counter()
+    job = _job_stats.setdefault(name, {"runs": 0, "failures": 0, "last_duration_ms": None, "last_error": None})
+    try:
+        result = await asyncio.to_thread(fn)
+    except Exception as e:
+        job["runs"] += 1
+        job["failures"] += 1
+        job["last_error"] = f"{type(e).__name__}: {e}"[:200]
+        with _lock:
+            _stats["failed"] += 1
+        print(f"❌ Background job {name} failed: {e}")
+        return None
+    finally:
+        job["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    job["runs"] += 1
+    with _lock:
+        _stats["completed"] += 1
+    if result is STOP:
+        _unschedule(name)
+    return result
+
+
+def _unschedule(name):
+    _periodic.pop(name, None)
+    task = _schedulers.pop(name, None)
+    if task is not None and task is not asyncio.current_task():
+        task.cancel()
+
+
+async def _worker():
+    while True:
+        item = _pop()
+        if item is None:
+            await _wakeup.wait()
+            _wakeup.clear()
+            continue
+        await _run(*item)
+
+
+async def _schedule(name, job):
+    if not job.run_at_start:
+        await asyncio.sleep(job.interval)
+    while name in _schedulers:
+        if job.queued:
+            submit(name, job.fn)
+        else:
+            await _run(name, job.fn)
+        await asyncio.sleep(job.interval)
+
+
+async def start():
+    """Start the workers and every registered periodic job (called from the app lifespan)"""
+    global _loop, _wakeup
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    for buffer in _buffers:
+        every(buffer.name, buffer.interval, buffer.flush)
+    for name, job in _periodic.items():
+        _schedulers[name] = asyncio.create_task(_schedule(name, job))
+    _workers[:] = [asyncio.create_task(_worker()) for _ in range(max(1, JOB_WORKERS))]
+    if _queue:
+        _wakeup.set()
+
+
+async def stop(drain_timeout=JOB_DRAIN_TIMEOUT_SECONDS):
+    """Cancel the scheduler and workers, then flush every buffer one last time.
+
+    Queued sweeps are not run; they simply happen after the next start.
+    """
+    global _loop
+    tasks = list(_schedulers.values()) + _workers
+    _schedulers.clear()
+    _workers.clear()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _loop = None
+
+    for buffer in _buffers:
+        try:
+            await asyncio.wait_for(asyncio.to_thread(buffer.flush), drain_timeout)
+        except Exception as e:
+            print(f"❌ Final flush of {buffer.name} failed: {e!r}")
+
+
+class WriteBuffer:
+    """Deferred writes coalesced by key and written in batches.
+
+    write(batch) receives a {key: value} dict in a worker thread and returns
+    the number of rows written. merge(previous, value) decides what a second
+    write to a pending key keeps (default: the newer value). If write raises,
+    the batch is put back unless a newer value for the key arrived meanwhile.
+    """
+
+    def __init__(self, name, write, interval, limit, flush_at=None, merge=None):
+        self.name = name
+        self.interval = interval
+        self.limit = limit
+        self.flush_at = flush_at or limit
+        self._write = write
+        self._merge = merge
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stats = {"added": 0, "coalesced": 0, "dropped": 0, "written": 0, "failed_flushes": 0}
+        _buffers.append(self)
+
+    def add(self, key, value):
+        """Record a write; returns False when the buffer is full and the write was dropped"""
+        with self._lock:
+            previous = self._pending.get(key)
+            if previous is None and len(self._pending) >= self.limit:
+                self._stats["dropped"] += 1
+                return False
+            if previous is not None:
+                self._stats["coalesced"] += 1
+                if self._merge is not None:
+                    value = self._merge(previous, value)
+            self._pending[key] = value
+            self._stats["added"] += 1
+            full = len(self._pending) >= self.flush_at
+        if full:
+            submit(self.name, self.flush)
+        return True
+
+    def flush(self):
+        """Write everything pending in one batch; returns the number of rows written"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            written = self._write(batch)
+        except Exception:
+            with self._lock:
+                self._stats["failed_flushes"] += 1
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+            raise
+        with self._lock:
+            self._stats["written"] += written
+        return written
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        return stats
+
+
+class EventBuffer:
+    """Append-only events written in batches, bounded to limit entries.
+
+    When the buffer is full, drop_policy decides what is lost: "newest" drops
+    the incoming event, "oldest" evicts the oldest pending one. Either way the
+    drop is counted, and no request ever waits on the database. A failed
+    write puts the batch back in front of newer events, as far as room allows.
+    """
+
+    def __init__(self, name, write, interval, limit, flush_at=None, drop_policy="newest"):
+        if drop_policy not in ("newest", "oldest"):
+            raise ValueError(f"Unsupported drop policy: {drop_policy}")
+        self.name = name
+        self.interval = interval
+        self.limit = limit
+        self.flush_at = flush_at or limit
+        self.drop_policy = drop_policy
+        self._write = write
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._stats = {"added": 0, "dropped": 0, "written": 0, "failed_flushes": 0}
+        _buffers.append(self)
+
+    def add(self, event):
+        """Record an event; returns False when it (or an older one) was dropped"""
+        accepted = True
+        with self._lock:
+            if len(self._pending) >= self.limit:
+                self._stats["dropped"] += 1
+                accepted = False
+                if self.drop_policy == "newest":
+                    return False
+                self._pending.popleft()
+            self._pending.append(event)
+            self._stats["added"] += 1
+            full = len(self._pending) >= self.flush_at
+        if full:
+            submit(self.name, self.flush)
+        return accepted
+
+    def flush(self):
+        """Write everything pending in one batch; returns the number of events written"""
+        with self._lock:
+            batch, self._pending = list(self._pending), deque()
+        if not batch:
+            return 0
+        try:
+            self._write(batch)
+        except Exception:
+            with self._lock:
+                self._stats["failed_flushes"] += 1
+                room = max(self.limit - len(self._pending), 0)
+                self._stats["dropped"] += max(len(batch) - room, 0)
+                self._pending.extendleft(reversed(batch[:room]))
+            raise
+        with self._lock:
+            self._stats["written"] += len(batch)
+        return len(batch)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        return stats
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["queued"] = len(_queue)
+    stats["running"] = _loop is not None
+    stats["jobs"] = {name: dict(job) for name, job in _job_stats.items()}
+    stats["buffers"] = {buffer.name: buffer.get_stats() for buffer in _buffers}
+    return stats
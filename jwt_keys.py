@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# jwt_keys.py
+"""
+Signing keys for access tokens and the public JWKS document.
+
+With JWT_ALGORITHM=HS256 (default) tokens are signed with the shared
+JWT_SECRET as before. With RS256 or EdDSA, tokens carry a `kid` header and
+downstream services verify them offline against /.well-known/jwks.json.
+
+Keys are PEM private keys (RSA for RS256, Ed25519 for EdDSA):
+  JWT_KEYS_DIR     directory of <kid>.pem files; every key is published and
+                   accepted, JWT_ACTIVE_KID signs (required once there is more
+                   than one key, so adding a file never changes the signer)
+  JWT_PRIVATE_KEY  a single PEM in the environment (\\n escapes allowed), kid
+                   from JWT_KEY_ID or the key's RFC 7638 thumbprint
+
+Rotation: pin JWT_ACTIVE_KID to the current kid, add the new key to
+JWT_KEYS_DIR and deploy (it is published but not used), switch JWT_ACTIVE_KID
+once consumers' JWKS caches have refreshed, and remove the old key after the
+longest token lifetime has passed.
+
+    python jwt_keys.py generate --algorithm EdDSA --out keys/
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import sys
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+JWT_SECRET = os.getenv("JWT_SECRET", "changeme")
+JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR", "")
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID", "")
+JWT_PRIVATE_KEY = os.getenv("JWT_PRIVATE_KEY", "")
+JWT_KEY_ID = os.getenv("JWT_KEY_ID", "")
+# Keep accepting HS256 tokens while cutting over to asymmetric signing
+JWT_ACCEPT_HS256 = os.getenv("JWT_ACCEPT_HS256", "false").lower() == "true"
+JWKS_MAX_AGE_SECONDS = int(os.getenv("JWKS_MAX_AGE_SECONDS", "300"))
+
+_ALGORITHMS = {"RS256": rsa.RSAPrivateKey, "EdDSA": ed25519.Ed25519PrivateKey}
+
+
+def _b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def public_jwk(private_key):
+    public_key = private_key.public_key()
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        return RSAAlgorithm.to_jwk(public_key, as_dict=True)
+    return OKPAlgorithm.to_jwk(public_key, as_dict=True)
+
+
+def thumbprint(jwk):
+    """RFC 7638 JWK thumbprint, used as the default kid"""
+    required = ("e", "kty", "n") if jwk["kty"] == "RSA" else ("crv", "kty", "x")
+    canonical = json.dumps({k: jwk[k] for k in required}, separators=(",", ":"), sort_keys=True)
+    return _b64url(hashlib.sha256(canonical.encode("utf-8")).digest())
+
+
+class KeyRing:
+    """kid -> private key for one algorithm; the active kid signs, every kid verifies"""
+
+    def __init__(self, algorithm, keys, active_kid):
+        self.algorithm = algorithm
+        self.keys = keys
+        self.active_kid = active_kid
+        self._public = {kid: key.public_key() for kid, key in keys.items()}
+        self.jwks = {
+            "keys": [
+                {**public_jwk(key), "kid": kid, "use": "sig", "alg": algorithm}
+                for kid, key in keys.items()
+            ]
+        }
+        self.jwks_body = json.dumps(self.jwks, separators=(",", ":")).encode("utf-8")
+        self.jwks_etag = '"' + hashlib.sha256(self.jwks_body).hexdigest()[:32] + '"'
+
+    def signing_key(self):
+        """(key, algorithm, headers) for jwt.encode"""
+        if not self.keys:
+            return JWT_SECRET, "HS256", None
+        return self.keys[self.active_kid], self.algorithm, {"kid": self.active_kid}
+
+    def verification_key(self, header):
+        """(key, algorithm) for a token's unverified header; raises KeyError when unknown"""
+        kid = header.get("kid")
+        if kid is not None and kid in self._public:
+            return self._public[kid], self.algorithm
+        if header.get("alg") == "HS256" and (not self.keys or JWT_ACCEPT_HS256):
+            return JWT_SECRET, "HS256"
+        raise KeyError(kid)
+
+
+def _load_pem(data, algorithm):
+    key = serialization.load_pem_private_key(data, password=None)
+    if not isinstance(key, _ALGORITHMS[algorithm]):
+        raise ValueError(f"JWT_ALGORITHM={algorithm} does not match key type {type(key).__name__}")
+    return key
+
+
+def load_keyring():
+    if JWT_ALGORITHM == "HS256":
+        return KeyRing("HS256", {}, None)
+    if JWT_ALGORITHM not in _ALGORITHMS:
+        raise ValueError(f"Unsupported JWT_ALGORITHM: {JWT_ALGORITHM}")
+
+    keys = {}
+    if JWT_KEYS_DIR:
+        for name in sorted(os.listdir(JWT_KEYS_DIR)):
+            if name.endswith(".pem"):
+                with open(os.path.join(JWT_KEYS_DIR, name), "rb") as f:
+                    keys[name[:-4]] = _load_pem(f.read(), JWT_ALGORITHM)
+    if JWT_PRIVATE_KEY:
+        key = _load_pem(JWT_PRIVATE_KEY.replace("\\n", "\n").encode("utf-8"), JWT_ALGORITHM)
+        keys[JWT_KEY_ID or thumbprint(public_jwk(key))] = key
+    if not keys:
+        raise ValueError(f"JWT_ALGORITHM={JWT_ALGORITHM} requires JWT_KEYS_DIR or JWT_PRIVATE_KEY")
+
+    if JWT_ACTIVE_KID:
+        active_kid = JWT_ACTIVE_KID
+    elif len(keys) == 1:
+        active_kid = next(iter(keys))
+    else:
+        raise ValueError(f"JWT_ACTIVE_KID is required with several signing keys: {', '.join(keys)}")
+    if active_kid not in keys:
+        raise ValueError(f"JWT_ACTIVE_KID {active_kid!r} not found among signing keys")
+    return KeyRing(JWT_ALGORITHM, keys, active_kid)
+
+
+_keyring = None
+
+
+def get_keyring():
+    """Keys are loaded on first use (the app calls this at startup to fail fast)"""
+    global _keyring
+    if _keyring is None:
+        _keyring = load_keyring()
+    return _keyring
+
+
+def generate(algorithm, out_dir):
+    """Write a new private key as <kid>.pem and return its path"""
+    if algorithm == "RS256":
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        key = ed25519.Ed25519PrivateKey.generate()
+    kid = thumbprint(public_jwk(key))
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{kid}.pem")
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(pem)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    gen = sub.add_parser("generate", help="Create a new signing key")
+    gen.add_argument("--algorithm", choices=sorted(_ALGORITHMS), default="EdDSA")
+    gen.add_argument("--out", default="keys", help="Directory for <kid>.pem (default: keys/)")
+    sub.add_parser("jwks", help="Print the JWKS document for the configured keys")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        print(f"✅ Wrote {generate(args.algorithm, args.out)}", file=sys.stderr)
+    else:
+        print(json.dumps(get_keyring().jwks, indent=2))
+
+
+if __name__ == "__main__":
+    main()
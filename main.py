@@ -1,98 +1,152 @@
 # main.py
-from fastapi import FastAPI, HTTPException
+"""
+Application entry point: `uvicorn main:app` or `create_app()`.
+
+Importing this module does no database work. Background tasks start and stop
+in the lifespan, and schema creation and migrations are a separate one-shot
+command (`python migrate.py`) run once per deploy rather than in every worker.
+"""
+from contextlib import asynccontextmanager
+
+import anyio.to_thread
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+import hmac
 import os
-import sys
 from dotenv import load_dotenv
 
 # Load environment variables first
 load_dotenv()
 
-print("🚀 Starting Digital Dossier Credential Service...")
-print(f"🌍 Python version: {sys.version}")
-print(f"📁 Working directory: {os.getcwd()}")
-
-# Debug environment variables
-print("🔍 Checking environment variables...")
-env_vars_to_check = ["DATABASE_URL", "SECRET_KEY", "FRONTEND_BASE_URL"]
-for var in env_vars_to_check:
-    value = os.getenv(var)
-    if value:
-        # Show only first 20 chars for security
-        print(f"✅ {var} = {value[:20]}...")
-    else:
-        print(f"❌ {var} = Not set")
-
-try:
-    from database import engine, Base, test_connection
-    print("✅ Database module imported successfully")
-except Exception as e:
-    print(f"❌ Failed to import database module: {e}")
-    print("This usually means DATABASE_URL is not properly configured")
-    sys.exit(1)
-
-try:
-    import models  # ensures models are registered
-    print("✅ Models imported successfully")
-except Exception as e:
-    print(f"❌ Failed to import models: {e}")
-    sys.exit(1)
-
-try:
+import audit
+import auth
+import database
+import email_migration
+import hashing
+import health
+import jobs
+import jwt_keys
+import metrics
+import models  # ensures models are registered
+import ratelimit
+import rehash
+import replica
+import sessions
+import tokens
+import user_cache
+from responses import ORJSONResponse
+if database.DB_ASYNC:
+    from routes import auth_async as auth_routes
+else:
     from routes import auth as auth_routes
-    from routes import oauth as oauth_routes
-    print("✅ Routes imported successfully")
-except Exception as e:
-    print(f"❌ Failed to import routes: {e}")
-    sys.exit(1)
-
-# Test database connection on startup
-print("🔧 Testing database connection...")
-if not test_connection():
-    print("❌ Failed to connect to database on startup")
-    print("This is likely a DATABASE_URL configuration issue")
-    # Don't exit immediately in Railway - let it retry
-    print("⚠️  Continuing startup, but database operations will fail")
-
-# Create all tables in the database
-try:
-    print("🗃️  Creating/verifying database tables...")
-    Base.metadata.create_all(bind=engine)
-    print("✅ Database tables created/verified")
-except Exception as e:
-    print(f"❌ Error creating database tables: {e}")
-    print("This may indicate a database connection or permission issue")
-
-# Create FastAPI app
-app = FastAPI(
-    title="Digital Dossier Credential Service",
-    description="Authentication service for Digital Dossier blog platform",
-    version="1.0.0",
-    docs_url="/docs" if os.getenv("NODE_ENV") != "production" else None,  # Disable docs in production
-    redoc_url="/redoc" if os.getenv("NODE_ENV") != "production" else None,
-)
-
-# Configure CORS for production
-frontend_url = os.getenv("FRONTEND_BASE_URL", "https://digitaldossier.us")
-print(f"🌐 Configuring CORS for frontend: {frontend_url}")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        frontend_url, 
-        "https://digitaldossier.us",
-        "https://www.digitaldossier.us"  # Include www variant
-    ],
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
-)
-
-# Include routers
-app.include_router(auth_routes.router, prefix="/auth", tags=["auth"])
-app.include_router(oauth_routes.router, tags=["oauth"])
-
-@app.get("/")
+from routes import oauth as oauth_routes
+from routes import users as users_routes
+
+router = APIRouter()
+
+def register_jobs():
+    """Periodic background work; deferred-write buffers (rehash, audit) register themselves"""
+    # The probe runs outside the shared queue so a long sweep cannot make /readyz stale
+    jobs.every("health.probe", health.HEALTH_PROBE_INTERVAL_SECONDS, health.run_probe, queued=False, run_at_start=True)
+    jobs.every("user_tokens.sweep", tokens.TOKEN_SWEEP_INTERVAL_SECONDS, tokens.sweep_job)
+    # Moves tokens emailed before user_tokens existed, so they keep working
+    jobs.every("users.legacy_token_sweep", tokens.TOKEN_SWEEP_INTERVAL_SECONDS, tokens.legacy_sweep_job, run_at_start=True)
+    jobs.every("auth_sessions.sweep", tokens.TOKEN_SWEEP_INTERVAL_SECONDS, sessions.sweep_job)
+    jobs.every("users.email_backfill", tokens.TOKEN_SWEEP_INTERVAL_SECONDS, email_migration.backfill_job, run_at_start=True)
+    jobs.every("login_events.partitions", audit.AUDIT_PARTITION_INTERVAL_SECONDS, audit.ensure_partitions, run_at_start=True)
+    if database.replica_engine is not None:
+        # Reads stay on the primary until the first lag reading arrives
+        jobs.every("replica.lag", replica.DB_REPLICA_LAG_CHECK_SECONDS, replica.run_check, queued=False, run_at_start=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print(
+        f"🚀 Starting Digital Dossier Credential Service "
+        f"({'async' if database.DB_ASYNC else 'sync'} database mode, port {os.getenv('PORT', '8000')})"
+    )
+    jwt_keys.get_keyring()  # fail fast on bad key configuration
+    # Sync handlers run on this pool; hashing sheds against the same size
+    anyio.to_thread.current_default_thread_limiter().total_tokens = hashing.REQUEST_THREADPOOL_SIZE
+    register_jobs()
+    await jobs.start()
+    try:
+        yield
+    finally:
+        await jobs.stop()  # also writes any deferred password rehashes
+        hashing.shutdown(wait=False)
+        # Requests have drained by now: close the pooled connections instead of
+        # leaving them for Postgres to time out when the worker exits
+        database.engine.dispose()
+        if database.replica_engine is not None:
+            database.replica_engine.dispose()
+        if database.async_engine is not None:
+            await database.async_engine.dispose()
+        if database.async_replica_engine is not None:
+            await database.async_replica_engine.dispose()
+
+async def hashing_overloaded_handler(request: Request, exc: hashing.HashingOverloaded):
+    """Shed load when the password hashing pool is saturated"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service busy, please retry"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+async def rate_limited_handler(request: Request, exc: ratelimit.RateLimited):
+    """Throttle brute-force attempts before any hashing or DB work"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests, please retry later"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@metrics.register_collector
+def collect_component_stats():
+    """Expose the counters behind /health as Prometheus samples"""
+    hash_stats = hashing.get_stats()
+    yield ("password_hash_in_flight", "gauge", "bcrypt jobs queued or running", {}, hash_stats["in_flight"])
+    yield ("password_hash_rejected_total", "counter", "bcrypt jobs shed with 503", {}, hash_stats["rejected"])
+    for name, stats in database.get_pool_stats().items():
+        labels = {"engine": name}
+        for key in ("checked_out", "overflow", "size"):
+            if isinstance(stats.get(key), int):
+                yield (f"db_pool_{key}", "gauge", f"Connection pool {key}", labels, stats[key])
+        for key in ("checkouts", "checkout_timeouts", "connects", "invalidations"):
+            if isinstance(stats.get(key), int):
+                yield (f"db_pool_{key}_total", "counter", f"Connection pool {key}", labels, stats[key])
+    cache_stats = user_cache.get_stats()
+    for key in ("hits", "misses", "errors", "invalidations"):
+        yield ("user_cache_events_total", "counter", "User profile cache events", {"event": key}, cache_stats[key])
+    limit_stats = ratelimit.get_stats()
+    yield ("rate_limit_checks_total", "counter", "Rate-limited endpoint checks", {}, limit_stats["checked"])
+    yield ("rate_limit_rejected_total", "counter", "Requests rejected with 429", {}, limit_stats["limited"])
+    token_stats = auth.token_cache.stats()
+    for key in ("hits", "misses"):
+        if key in token_stats:
+            yield ("token_cache_events_total", "counter", "Access token cache events", {"event": key}, token_stats[key])
+    job_stats = jobs.get_stats()
+    yield ("background_jobs_queued", "gauge", "Background jobs waiting for a worker", {}, job_stats["queued"])
+    yield ("background_jobs_dropped_total", "counter", "Background jobs dropped on a full queue", {}, job_stats["dropped"])
+    for name, job in job_stats["jobs"].items():
+        yield ("background_job_runs_total", "counter", "Background job runs", {"job": name}, job["runs"])
+        yield ("background_job_failures_total", "counter", "Background job failures", {"job": name}, job["failures"])
+    audit_stats = audit.get_stats()
+    yield ("audit_events_pending", "gauge", "Login events buffered for the next flush", {}, audit_stats["pending"])
+    yield ("audit_events_written_total", "counter", "Login events written", {}, audit_stats["written"])
+    yield ("audit_events_dropped_total", "counter", "Login events dropped by backpressure", {"policy": audit_stats["drop_policy"]}, audit_stats["dropped"])
+    rehash_stats = rehash.get_stats()
+    yield ("password_rehash_pending", "gauge", "Hash upgrades waiting to be written", {}, rehash_stats["pending"])
+    yield ("password_rehash_written_total", "counter", "Hash upgrades written", {}, rehash_stats["written"])
+    replica_stats = replica.get_stats()
+    if replica_stats["configured"]:
+        yield ("db_replica_usable", "gauge", "1 while reads are routed to the replica", {}, int(replica_stats["usable"]))
+        if replica_stats["lag_seconds"] is not None:
+            yield ("db_replica_lag_seconds", "gauge", "Last measured replica replay lag", {}, replica_stats["lag_seconds"])
+        for key in ("replica_reads", "primary_fallbacks", "pinned_reads", "miss_retries"):
+            yield ("db_replica_routing_total", "counter", "Read-only session routing decisions", {"route": key}, replica_stats[key])
+
+@router.get("/")
 def read_root():
     """Root endpoint for basic connectivity testing"""
     return {
@@ -102,32 +156,86 @@ def read_root():
         "environment": os.getenv("NODE_ENV", "development")
     }
 
-@app.get("/health")
-def health_check():
+@router.get("/livez")
+async def liveness_check():
+    """Liveness: the event loop is responding. No I/O."""
+    return {"status": "alive"}
+
+def _show_internals(authorization):
+    """Pool, cache, job and replica stats are for operators: only with the METRICS_TOKEN bearer.
+    Unlike /metrics, they stay hidden when METRICS_TOKEN is unset."""
+    expected = os.getenv("METRICS_TOKEN")
+    return bool(expected) and hmac.compare_digest(
+        authorization.encode("utf-8"), f"Bearer {expected}".encode("utf-8")
+    )
+
+@router.get("/readyz")
+async def readiness_check(authorization: str = Header("")):
+    """Readiness from the cached background DB probe; never touches the database itself"""
+    db = health.get_status()
+    content = {"status": "ready" if db["ok"] else "not_ready"}
+    if _show_internals(authorization):
+        content.update({"database": db, "db_pool": database.get_pool_stats()})
+    return JSONResponse(status_code=200 if db["ok"] else 503, content=content)
+
+@router.get("/health")
+async def health_check(authorization: str = Header("")):
     """Comprehensive health check endpoint for Railway"""
     try:
-        db_status = test_connection()
+        db_status = bool(health.get_status()["ok"])
         
         # Check environment variables
         env_status = bool(os.getenv("DATABASE_URL") and os.getenv("SECRET_KEY"))
         
         overall_status = "healthy" if (db_status and env_status) else "unhealthy"
         
-        return {
+        result = {
             "status": overall_status,
             "database": "connected" if db_status else "disconnected", 
             "environment": "configured" if env_status else "missing_variables",
             "service": "credential-management",
             "timestamp": os.getenv("RAILWAY_DEPLOYMENT_ID", "local")
         }
-    except Exception as e:
+        if _show_internals(authorization):
+            result.update({
+                "hash_pool": hashing.get_stats(),
+                "db_pool": database.get_pool_stats(),
+                "user_cache": user_cache.get_stats(),
+                "rate_limit": ratelimit.get_stats(),
+                "sessions": sessions.get_stats(),
+                "rehash": rehash.get_stats(),
+                "audit": audit.get_stats(),
+                "jobs": jobs.get_stats(),
+                "replica": replica.get_stats(),
+            })
+        return result
+    except Exception:
         return {
             "status": "unhealthy",
-            "error": str(e),
             "service": "credential-management"
         }
 
-@app.get("/debug/env")
+@router.get("/.well-known/jwks.json", include_in_schema=False)
+async def jwks(request: Request):
+    """Public signing keys so other services can verify access tokens offline"""
+    keyring = jwt_keys.get_keyring()
+    headers = {
+        "Cache-Control": f"public, max-age={jwt_keys.JWKS_MAX_AGE_SECONDS}",
+        "ETag": keyring.jwks_etag,
+    }
+    if request.headers.get("if-none-match") == keyring.jwks_etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=keyring.jwks_body, media_type="application/json", headers=headers)
+
+@router.get("/metrics", include_in_schema=False)
+def metrics_endpoint(authorization: str = Header("")):
+    """Prometheus scrape endpoint; set METRICS_TOKEN to require a bearer token"""
+    expected = os.getenv("METRICS_TOKEN")
+    if expected and not hmac.compare_digest(authorization, f"Bearer {expected}"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/debug/env")
 def debug_environment():
     """Debug endpoint to check environment variables (remove in production)"""
     # Only show this in development or if specifically enabled
@@ -146,5 +254,39 @@ def debug_environment():
         "working_directory": os.getcwd()
     }
 
-print("✅ FastAPI application configured successfully")
-print(f"🎯 Ready to serve requests on port {os.getenv('PORT', '8000')}")
+def create_app() -> FastAPI:
+    app = FastAPI(
+        title="Digital Dossier Credential Service",
+        description="Authentication service for Digital Dossier blog platform",
+        version="1.0.0",
+        docs_url="/docs" if os.getenv("NODE_ENV") != "production" else None,  # Disable docs in production
+        redoc_url="/redoc" if os.getenv("NODE_ENV") != "production" else None,
+        default_response_class=ORJSONResponse,  # dict returns rendered by orjson
+        lifespan=lifespan,
+    )
+
+    # Configure CORS for production
+    frontend_url = os.getenv("FRONTEND_BASE_URL", "https://digitaldossier.us")
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            frontend_url,
+            "https://digitaldossier.us",
+            "https://www.digitaldossier.us"  # Include www variant
+        ],
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.add_exception_handler(hashing.HashingOverloaded, hashing_overloaded_handler)
+    app.add_exception_handler(ratelimit.RateLimited, rate_limited_handler)
+
+    # Include routers
+    app.include_router(auth_routes.router, prefix="/auth", tags=["auth"])
+    app.include_router(users_routes.router, prefix="/auth", tags=["users"])
+    app.include_router(oauth_routes.router, tags=["oauth"])
+    app.include_router(router)
+    return app
+
+app = create_app()
@@ -0,0 +1,224 @@
+# metrics.py
+"""
+Prometheus-style metrics with per-request stage timing.
+
+Exposes counters and histograms in the Prometheus text format (served at
+/metrics) without extra dependencies. MetricsMiddleware records per-route
+request counts and latency, and splits each request into the time spent in
+DB queries, pool checkout wait, password hashing and JWT encode/decode. Those
+stages are reported through record_stage(), which the database, hashing and
+auth modules call.
+
+Stage totals live in a per-request dict held in a ContextVar. Starlette copies
+the context into threadpool workers, so sync handlers feed the same dict.
+"""
+import threading
+import time
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGES = ("db", "pool", "hash", "jwt")
+
+_request_stages = ContextVar("request_stages", default=None)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(names, labels + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+# ----------------------------
+# Registry
+# ----------------------------
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+REQUEST_STAGE_LATENCY = Histogram(
+    "http_request_stage_seconds", "Per-request time spent in a stage (db, pool, hash, jwt)", ("route", "stage")
+)
+DB_QUERY_LATENCY = Histogram("db_query_duration_seconds", "SQL statement execution time", ("engine",))
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time waiting for a pooled DB connection", ("engine",)
+)
+HASH_LATENCY = Histogram("password_hash_duration_seconds", "Caller-observed bcrypt time incl. queueing", ("operation",))
+JWT_LATENCY = Histogram("jwt_duration_seconds", "JWT encode/decode time", ("operation",),
+                        buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01))
+
+_metrics = [
+    REQUESTS, REQUEST_LATENCY, REQUEST_STAGE_LATENCY,
+    DB_QUERY_LATENCY, DB_POOL_CHECKOUT_WAIT, HASH_LATENCY, JWT_LATENCY,
+]
+_collectors = []
+
+
+def register_collector(fn):
+    """Register fn() -> iterable of (name, type, help, {labels}, value) sampled at scrape time"""
+    _collectors.append(fn)
+    return fn
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    seen = set()
+    for collector in _collectors:
+        try:
+            samples = list(collector())
+        except Exception:
+            continue
+        for name, metric_type, documentation, labels, value in samples:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ----------------------------
+# Stage timing
+# ----------------------------
+def record_stage(stage, seconds):
+    """Add time spent in a stage to the current request, if there is one"""
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] += seconds
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: per-route counts, latency and stage breakdown"""
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths = None
+
+    def _route_label(self, scope):
+        # scope["route"] is the route as declared on its APIRouter, without the
+        # include_router prefix; map its endpoint back to the app-level template.
+        # Templated paths keep label cardinality bounded.
+        route = scope.get("route")
+        if route is None:
+            return "unmatched"
+        if self._route_paths is None:
+            routes = getattr(scope.get("app"), "routes", ())
+            try:
+                # FastAPI versions that include routers lazily
+                from fastapi.routing import iter_route_contexts
+                routes = iter_route_contexts(routes)
+            except ImportError:
+                pass
+            self._route_paths = {
+                getattr(r, "endpoint", None): r.path for r in routes if hasattr(r, "path")
+            }
+        return self._route_paths.get(getattr(route, "endpoint", None)) or getattr(route, "path", "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stages = dict.fromkeys(STAGES, 0.0)
+        token = _request_stages.set(stages)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_stages.reset(token)
+            route_label = self._route_label(scope)
+            method = scope["method"]
+            REQUESTS.inc(method, route_label, status["code"])
+            REQUEST_LATENCY.observe(elapsed, method, route_label)
+            for stage, seconds in stages.items():
+                if seconds:
+                    REQUEST_STAGE_LATENCY.observe(seconds, route_label, stage)
+
+
+def instrument_engine(sync_engine, name):
+    """Time every statement on an engine (pass async_engine.sync_engine for async engines)"""
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        DB_QUERY_LATENCY.observe(elapsed, name)
+        record_stage("db", elapsed)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _on_error(context):
+        starts = context.connection.info.get("metrics_query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
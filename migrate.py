@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Release step: bring the database up to date before the new code serves traffic.
+
+Runs, in order, steps that are each safe to re-run:
+  1. create_tables.py   - create missing tables (user_tokens, auth_sessions,
+                          login_events, user_last_logins, ...)
+  2. email_migration.py - add, backfill and dedup users.email_normalized and
+                          build its indexes; duplicates go to the report
+  3. legacy tokens      - move live verification/reset tokens from the old
+                          users columns into user_tokens
+
+Railway runs it as the pre-deploy command (railway.toml / railway.json), the
+Procfile declares it as the release process, and entrypoint.sh runs it when
+DB_CREATE_SCHEMA=true:
+
+    python migrate.py --report migrate-report.json
+"""
+import argparse
+import json
+import sys
+
+import email_migration
+import tokens
+from create_tables import create_tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=email_migration.EMAIL_BACKFILL_BATCH_SIZE)
+    parser.add_argument("--report", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    from database import engine
+
+    create_tables()
+    report = {"email": email_migration.migrate(engine, args.batch_size)}
+    print("🔄 Moving live legacy tokens to user_tokens...", file=sys.stderr)
+    cleared, migrated = tokens.migrate_legacy_columns()
+    report["legacy_tokens"] = {"users_cleared": cleared, "tokens_migrated": migrated}
+
+    output = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    print(
+        f"✅ Database migrated: {report['email']['backfilled']} emails normalized, "
+        f"{len(report['email']['duplicates'])} duplicate addresses resolved, {migrated} legacy tokens moved",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,26 @@
 # models.py
-from sqlalchemy import Column, String, Boolean, DateTime, Integer
+import enum
+from sqlalchemy import Column, DDL, String, Boolean, DateTime, Integer, ForeignKey, Enum, Index, event
 from sqlalchemy.sql import func
 from database import Base
 
+def normalize_email(email):
+    """Canonical form used for every email lookup and uniqueness check"""
+    return email.strip().lower() if email else email
+
+def _default_email_normalized(context):
+    return normalize_email(context.get_current_parameters().get("email"))
+
 class User(Base):
     __tablename__ = "users"
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String, index=True)  # Unique user identifier (e.g., "suvodutta" for superuser)
-    email = Column(String, unique=True, index=True, nullable=False)
+    email = Column(String, unique=True, index=True, nullable=False)  # as entered, for display
+    # Lookup key: every route matches on this unique index, so case variants
+    # resolve to one account. Filled on insert from email; existing rows are
+    # backfilled by email_migration.py (run by migrate.py at release).
+    email_normalized = Column(String, unique=True, index=True, nullable=True, default=_default_email_normalized)
     username = Column(String, index=True, nullable=False)
     hashed_password = Column(String, nullable=True)  # Nullable for OAuth accounts
     is_active = Column(Boolean, default=True)
@@ -16,7 +28,108 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
-    # Fields for email verification and password reset
+    # Legacy single-slot token fields, superseded by UserToken. No longer
+    # written; live values are moved to user_tokens by
+    # tokens.migrate_legacy_columns() and the columns cleared.
     email_verification_token = Column(String, nullable=True)
     password_reset_token = Column(String, nullable=True)
     token_expiration = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Rows still waiting for the backfill; empty once it has run
+        Index(
+            "ix_users_email_unnormalized",
+            "id",
+            postgresql_where=email_normalized.is_(None),
+            sqlite_where=email_normalized.is_(None),
+        ),
+    )
+
+class TokenPurpose(str, enum.Enum):
+    EMAIL_VERIFICATION = "email_verification"
+    PASSWORD_RESET = "password_reset"
+
+class UserToken(Base):
+    """One-time email verification / password reset token, stored by SHA-256 hash"""
+    __tablename__ = "user_tokens"
+
+    token_hash = Column(String(64), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    purpose = Column(
+        Enum(TokenPurpose, name="token_purpose", values_callable=lambda e: [m.value for m in e]),
+        nullable=False,
+    )
+    expires_at = Column(DateTime, nullable=False)
+    consumed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # Live tokens per user/purpose, used to revoke older tokens on re-issue
+        Index(
+            "ix_user_tokens_live",
+            "user_id",
+            "purpose",
+            postgresql_where=consumed_at.is_(None),
+            sqlite_where=consumed_at.is_(None),
+        ),
+        # Drives the expired-token sweeper
+        Index("ix_user_tokens_expires_at", "expires_at"),
+    )
+
+class AuthSession(Base):
+    """Refresh-token session: one row per login, holding only the current and previous token hashes"""
+    __tablename__ = "auth_sessions"
+
+    id = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_uuid = Column(String(36), nullable=False)  # access-token subject, saves a join on refresh
+    refresh_hash = Column(String(64), nullable=False, unique=True)
+    # Hash of the token this one replaced; presenting it again signals theft
+    previous_hash = Column(String(64), nullable=True, index=True)
+    created_at = Column(DateTime, nullable=False)
+    last_used_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, nullable=True)
+
+class UserLastLogin(Base):
+    """Most recent successful login per user, upserted in batches from the login event buffer"""
+    __tablename__ = "user_last_logins"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    last_login_at = Column(DateTime, nullable=False)
+    last_login_ip = Column(String(64), nullable=True)
+
+class LoginEvent(Base):
+    """Login audit trail (success, failure, unverified) written in batches by audit.py.
+
+    On PostgreSQL the table is range-partitioned by month on occurred_at, so
+    time-bounded queries only touch the relevant partitions and old months can
+    be detached or dropped wholesale. The primary key must include the
+    partition key, hence (id, occurred_at).
+    """
+    __tablename__ = "login_events"
+
+    id = Column(String(32), primary_key=True)
+    occurred_at = Column(DateTime, primary_key=True)
+    event = Column(String(32), nullable=False)
+    # UUID and email as presented; no FK so the history outlives the account
+    user_id = Column(String(36), nullable=True)
+    email = Column(String, nullable=False)
+    ip = Column(String(64), nullable=True)
+    user_agent = Column(String(255), nullable=True)
+
+    __table_args__ = (
+        Index("ix_login_events_user_id_occurred_at", "user_id", "occurred_at"),
+        Index("ix_login_events_email_occurred_at", "email", "occurred_at"),
+        {"postgresql_partition_by": "RANGE (occurred_at)"},
+    )
+
+# Catches rows for months that have no partition yet; audit.ensure_partitions
+# creates the monthly ones ahead of time.
+event.listen(
+    LoginEvent.__table__,
+    "after_create",
+    DDL("CREATE TABLE IF NOT EXISTS login_events_default PARTITION OF login_events DEFAULT").execute_if(
+        dialect="postgresql"
+    ),
+)
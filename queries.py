@@ -0,0 +1,162 @@
+# queries.py
+"""
+Prebuilt statements for the hot auth paths.
+
+Each statement is built once at import, with bindparam() placeholders for its
+inputs, and executed with a parameter dict. A request therefore skips ORM
+Query construction, entity loading and identity-map bookkeeping. SQLAlchemy
+memoizes the cache key of a statement object, so each execution is a
+compiled-cache hit, and the SQL string is identical every time. That identical
+string is what lets the driver reuse a server-side prepared statement (see
+DB_PREPARED_STATEMENT_CACHE_SIZE / DB_PREPARE_THRESHOLD in database.py).
+
+Every statement selects only the columns its caller reads. hashed_password
+is loaded only by the credential queries that login, change-password and the
+reset/resend requests run against the primary; it is never cached.
+"""
+from sqlalchemy import bindparam, delete, select, update
+
+from models import AuthSession, User, UserToken
+
+# ----------------------------
+# Users
+# ----------------------------
+# Cached per user by user_cache (public fields only)
+PROFILE_COLUMNS = (
+    User.id, User.user_id, User.email, User.username,
+    User.is_active, User.is_verified, User.created_at,
+)
+
+# Read fresh from the primary by every path that authenticates or issues a
+# token, so a password change or deletion on any worker applies at once
+CREDENTIAL_COLUMNS = (
+    User.id, User.user_id, User.email, User.username, User.hashed_password,
+    User.is_active, User.is_verified,
+)
+
+# params: email (already normalized)
+PROFILE_BY_EMAIL = select(*PROFILE_COLUMNS).where(User.email_normalized == bindparam("email"))
+
+# params: email (already normalized)
+CREDENTIALS_BY_EMAIL = select(*CREDENTIAL_COLUMNS).where(User.email_normalized == bindparam("email"))
+
+# params: user_uuid
+CREDENTIALS_BY_UUID = select(*CREDENTIAL_COLUMNS).where(User.user_id == bindparam("user_uuid"))
+
+# params: user_uuid; resolves bearer tokens (auth.get_current_user) on a cache miss
+PROFILE_BY_UUID = select(*PROFILE_COLUMNS).where(User.user_id == bindparam("user_uuid"))
+
+# params: pk
+MARK_VERIFIED = (
+    update(User)
+    .where(User.id == bindparam("pk"))
+    .values(is_verified=True)
+    .execution_options(synchronize_session=False)
+)
+
+# params: pk, new_hash
+SET_PASSWORD = (
+    update(User)
+    .where(User.id == bindparam("pk"))
+    .values(hashed_password=bindparam("new_hash"))
+    .execution_options(synchronize_session=False)
+)
+
+# params: user_uuid. One round trip instead of load-then-delete; the email
+# comes back for cache invalidation. Child rows go with ON DELETE CASCADE.
+DELETE_USER_BY_UUID = (
+    delete(User)
+    .where(User.user_id == bindparam("user_uuid"))
+    .returning(User.email)
+    .execution_options(synchronize_session=False)
+)
+
+# ----------------------------
+# One-time tokens (tokens.py)
+# ----------------------------
+# params: digest, token_purpose. Expiry is checked by the caller so it can tell
+# expired tokens from unknown ones.
+LIVE_TOKEN = (
+    select(
+        UserToken.token_hash, UserToken.expires_at,
+        User.id.label("user_pk"), User.user_id, User.email,
+    )
+    .join(User, User.id == UserToken.user_id)
+    .where(
+        UserToken.token_hash == bindparam("digest"),
+        UserToken.purpose == bindparam("token_purpose"),
+        UserToken.consumed_at.is_(None),
+    )
+)
+
+# params: digest, now. Conditional, so of two concurrent redemptions only one
+# sees rowcount 1.
+CONSUME_TOKEN = (
+    update(UserToken)
+    .where(UserToken.token_hash == bindparam("digest"), UserToken.consumed_at.is_(None))
+    .values(consumed_at=bindparam("now"))
+    .execution_options(synchronize_session=False)
+)
+
+# params: user_pk, token_purpose, now
+REVOKE_LIVE_TOKENS = (
+    update(UserToken)
+    .where(
+        UserToken.user_id == bindparam("user_pk"),
+        UserToken.purpose == bindparam("token_purpose"),
+        UserToken.consumed_at.is_(None),
+    )
+    .values(consumed_at=bindparam("now"))
+    .execution_options(synchronize_session=False)
+)
+
+# ----------------------------
+# Refresh-token sessions (sessions.py)
+# ----------------------------
+_ROTATE_RETURNING = (AuthSession.id, AuthSession.user_uuid, AuthSession.expires_at)
+
+
+def _rotate(by_id):
+    stmt = update(AuthSession).where(
+        AuthSession.refresh_hash == bindparam("old_hash"),
+        AuthSession.revoked_at.is_(None),
+        AuthSession.expires_at > bindparam("now"),
+    )
+    if by_id:
+        stmt = stmt.where(AuthSession.id == bindparam("session_id"))
+    return (
+        stmt.values(refresh_hash=bindparam("new_hash"), previous_hash=bindparam("old_hash"), last_used_at=bindparam("now"))
+        .returning(*_ROTATE_RETURNING)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# params: old_hash, new_hash, now
+ROTATE_SESSION = _rotate(by_id=False)
+
+# params: old_hash, new_hash, now, session_id (the hot set knows it: primary key probe)
+ROTATE_SESSION_BY_ID = _rotate(by_id=True)
+
+# params: old_hash
+REPLAYED_SESSION = select(AuthSession.id, AuthSession.last_used_at).where(
+    AuthSession.previous_hash == bindparam("old_hash")
+)
+
+
+def _revoke(*criteria):
+    return (
+        update(AuthSession)
+        .where(AuthSession.revoked_at.is_(None), *criteria)
+        .values(revoked_at=bindparam("now"))
+        .execution_options(synchronize_session=False)
+    )
+
+
+# params: session_id, now
+REVOKE_SESSION_BY_ID = _revoke(AuthSession.id == bindparam("session_id"))
+
+# params: digest, now
+REVOKE_SESSION_BY_HASH = _revoke(AuthSession.refresh_hash == bindparam("digest"))
+
+# params: user_pk, now
+REVOKE_USER_SESSIONS = _revoke(AuthSession.user_id == bindparam("user_pk"))
@@ -0,0 +1,247 @@
+# ratelimit.py
+"""
+Brute-force and abuse throttling for the credential endpoints.
+
+Every guarded request is checked against up to three keys: client IP, email,
+and IP+email. Checks run at the top of the route handler, before any bcrypt
+or database work, and a rejected request raises RateLimited (429 +
+Retry-After) so an attacker cannot make us burn a hash per request.
+
+Limits use a sliding-window counter: each key keeps the count of the current
+and previous fixed window, and the previous one is weighted by how much of it
+still overlaps the sliding window. That is O(1) time and memory per key.
+
+Backends (RATE_LIMIT_BACKEND):
+  local  - in-process (default). Keys are kept in least-recently-used order and
+           idle ones are evicted as new checks come in. Limits apply per
+           worker, so the effective limit is roughly limit x workers.
+  redis  - shared counters at RATE_LIMIT_URL (defaults to USER_CACHE_URL) so the
+           limits hold across workers and replicas. Requires the `redis` package.
+  none   - throttling disabled.
+
+The async router calls acheck(), which runs the redis backend's blocking
+round trip in a worker thread instead of on the event loop.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local").lower()
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", os.getenv("USER_CACHE_URL", "redis://localhost:6379/0"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Number of reverse proxies in front of the app whose X-Forwarded-For entries
+# are trusted (Railway/load balancer = 1, set in railway.toml). 0 uses the
+# socket peer address, which behind a proxy is the proxy itself: every client
+# would share one ip bucket.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "0"))
+
+# "<key>=<limit>/<window seconds>,..." per endpoint; key is ip, email or ip_email
+DEFAULT_RULES = {
+    "login": "ip=30/60,email=10/300,ip_email=5/60",
+    "reset_password": "ip=10/600,email=3/900,ip_email=3/900",
+    "resend_verification": "ip=10/600,email=3/900,ip_email=3/900",
+}
+
+
+class RateLimited(Exception):
+    """Raised when a request exceeds one of its endpoint's limits."""
+
+    def __init__(self, retry_after):
+        super().__init__("Too many requests")
+        self.retry_after = retry_after
+
+
+def parse_rules(spec):
+    """'ip=30/60,email=10/300' -> {"ip": (30, 60.0), "email": (10, 300.0)}"""
+    rules = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, limit = part.partition("=")
+        count, _, window = limit.partition("/")
+        rules[name.strip()] = (int(count), float(window))
+    return rules
+
+
+RULES = {
+    endpoint: parse_rules(os.getenv(f"RATE_LIMIT_{endpoint.upper()}", default))
+    for endpoint, default in DEFAULT_RULES.items()
+}
+
+
+def _weighted(current, previous, window_start, window, now):
+    overlap = 1.0 - (now - window_start) / window
+    return current + previous * max(overlap, 0.0)
+
+
+class LocalBackend:
+    remote = False
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._entries = OrderedDict()  # key -> [window_start, current, previous, window]
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window, now):
+        """Count one request; returns seconds to wait, or 0 when allowed"""
+        with self._lock:
+            entry = self._entries.get(key)
+            window_start = now - (now % window)
+            if entry is None:
+                entry = self._entries[key] = [window_start, 0, 0, window]
+            else:
+                self._entries.move_to_end(key)
+                elapsed_windows = (window_start - entry[0]) / window
+                if elapsed_windows >= 2:
+                    entry[0], entry[1], entry[2] = window_start, 0, 0
+                elif elapsed_windows >= 1:
+                    entry[0], entry[1], entry[2] = window_start, 0, entry[1]
+
+            if _weighted(entry[1], entry[2], entry[0], window, now) >= limit:
+                wait = _retry_after(entry[1], entry[2], entry[0], limit, window, now)
+            else:
+                entry[1] += 1
+                wait = 0
+            self._evict_idle(now)
+            return wait
+
+    def _evict_idle(self, now):
+        # Least recently used first: stop at the first key still inside its
+        # window pair, so each check does amortized O(1) eviction work.
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_keys and now - entry[0] < 2 * entry[3]:
+                break
+            del self._entries[key]
+
+    def size(self):
+        return len(self._entries)
+
+
+# KEYS: current window, previous window. ARGV: weight of the previous window,
+# limit, TTL. Counts the request only when it is allowed (like LocalBackend),
+# so a client hammering a closed limit doesn't keep extending its own block.
+# Returns {allowed, current count before this request, previous count}.
+_REDIS_HIT_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if current + previous * tonumber(ARGV[1]) >= tonumber(ARGV[2]) then
+    return {0, current, previous}
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return {1, current, previous}
+"""
+
+
+class RedisBackend:
+    remote = True  # blocking network calls: acheck() offloads them
+
+    def __init__(self, url=RATE_LIMIT_URL):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package")
+        self._client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self._hit = self._client.register_script(_REDIS_HIT_SCRIPT)
+
+    def hit(self, key, limit, window, now):
+        window_start = now - (now % window)
+        current_key = f"rl:{key}:{int(window_start)}"
+        previous_key = f"rl:{key}:{int(window_start - window)}"
+        overlap = max(1.0 - (now - window_start) / window, 0.0)
+        allowed, current, previous = self._hit(
+            keys=[current_key, previous_key], args=[repr(overlap), limit, int(2 * window) + 1]
+        )
+        if allowed:
+            return 0
+        return _retry_after(int(current), int(previous), window_start, limit, window, now)
+
+    def size(self):
+        return None
+
+
+def _retry_after(current, previous, window_start, limit, window, now):
+    """Seconds until the weighted count drops below the limit"""
+    if current >= limit or previous == 0:
+        wait = window_start + window - now
+    else:
+        # previous * (1 - (t - window_start) / window) + current < limit
+        wait = window_start + window * (1 - (limit - current) / previous) - now
+    return max(1, math.ceil(wait))
+
+
+def _create_backend():
+    if RATE_LIMIT_BACKEND == "none":
+        return None
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisBackend()
+    return LocalBackend()
+
+
+backend = _create_backend()
+_stats = {"checked": 0, "limited": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def client_ip(request):
+    """Client address, honouring RATE_LIMIT_TRUSTED_PROXIES hops of X-Forwarded-For"""
+    if RATE_LIMIT_TRUSTED_PROXIES > 0:
+        forwarded = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        if forwarded:
+            return forwarded[-min(RATE_LIMIT_TRUSTED_PROXIES, len(forwarded))]
+    return request.client.host if request.client else "unknown"
+
+
+def check(endpoint, request, email=None):
+    """Count a request against the endpoint's limits; raises RateLimited when any is exceeded"""
+    if backend is None:
+        return
+    rules = RULES.get(endpoint)
+    if not rules:
+        return
+
+    ip = client_ip(request)
+    email = (email or "").strip().lower()
+    keys = {"ip": ip, "email": email, "ip_email": f"{ip}|{email}"}
+    now = time.time()
+    retry_after = 0
+    _count("checked")
+    for name, (limit, window) in rules.items():
+        if name != "ip" and not email:
+            continue
+        try:
+            wait = backend.hit(f"{endpoint}:{name}:{keys[name]}", limit, window, now)
+        except Exception:
+            # Fail open: a cache outage must not lock everyone out
+            _count("errors")
+            continue
+        retry_after = max(retry_after, wait)
+    if retry_after:
+        _count("limited")
+        raise RateLimited(retry_after)
+
+
+async def acheck(endpoint, request, email=None):
+    """check() for async handlers"""
+    if backend is not None and backend.remote:
+        await asyncio.to_thread(check, endpoint, request, email)
+    else:
+        check(endpoint, request, email)
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["backend"] = RATE_LIMIT_BACKEND
+    stats["keys"] = backend.size() if backend is not None else 0
+    return stats
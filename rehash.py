@@ -0,0 +1,79 @@
+# rehash.py
+"""
+Deferred password-hash upgrades.
+
+When login finds a hash that is outdated under the current policy (fewer
+bcrypt rounds, or bcrypt while argon2 is configured), the new hash is computed
+with the verify and handed to enqueue(); the request returns without writing.
+Pending upgrades live in a jobs.WriteBuffer keyed by user, and are written
+in one executemany UPDATE per flush. Each UPDATE is conditional on the old
+hash, so a password change that lands first always wins.
+"""
+import os
+
+from sqlalchemy import bindparam, update
+
+import jobs
+from models import User
+
+REHASH_FLUSH_INTERVAL_SECONDS = float(os.getenv("REHASH_FLUSH_INTERVAL_SECONDS", "5"))
+# Upgrades beyond this are dropped; the user is simply upgraded on a later login
+REHASH_QUEUE_LIMIT = int(os.getenv("REHASH_QUEUE_LIMIT", "10000"))
+# A login burst flushes early instead of waiting for the interval
+REHASH_FLUSH_BATCH_SIZE = int(os.getenv("REHASH_FLUSH_BATCH_SIZE", "500"))
+
+_stale = 0  # upgrades skipped because the password changed first
+
+
+def _keep_stored_hash(previous, entry):
+    # The hash that is actually stored stays the guard when coalescing
+    return (previous[0],) + entry[1:]
+
+
+_update_stmt = (
+    update(User)
+    .where(User.id == bindparam("pk"), User.hashed_password == bindparam("old_hash"))
+    .values(hashed_password=bindparam("new_hash"))
+)
+
+
+def _write(batch):
+    global _stale
+    import user_cache
+    from database import engine
+
+    params = [{"pk": pk, "old_hash": old, "new_hash": new} for pk, (old, new, _, _) in batch.items()]
+    with engine.begin() as conn:
+        written = conn.execute(_update_stmt, params).rowcount
+    for _, _, email, user_uuid in batch.values():
+        user_cache.invalidate(email=email, user_id=user_uuid)
+    if written < 0:  # driver does not report executemany rowcounts
+        written = len(batch)
+    _stale += len(batch) - written
+    return written
+
+
+buffer = jobs.WriteBuffer(
+    "rehash.flush",
+    _write,
+    interval=REHASH_FLUSH_INTERVAL_SECONDS,
+    limit=REHASH_QUEUE_LIMIT,
+    flush_at=REHASH_FLUSH_BATCH_SIZE,
+    merge=_keep_stored_hash,
+)
+
+
+def enqueue(user_pk, old_hash, new_hash, email, user_uuid):
+    """Defer writing new_hash for user_pk; called from the login handler"""
+    buffer.add(user_pk, (old_hash, new_hash, email, user_uuid))
+
+
+def flush():
+    """Write every pending upgrade now; returns the number of rows updated"""
+    return buffer.flush()
+
+
+def get_stats():
+    stats = buffer.get_stats()
+    stats["stale"] = _stale
+    return stats
@@ -0,0 +1,207 @@
+# replica.py
+"""
+Read-replica routing state: replication lag, read-your-writes pins and the
+per-session routing helpers.
+
+Read-only dependencies (GET /auth/users/by-email, /auth/users/lookup, the
+listing/export and login-events endpoints) open database.ReadSessionLocal.
+It is a RoutingSession that sends reads to DATABASE_REPLICA_URL while the
+replica is usable. Everything else, including every write and
+SELECT ... FOR UPDATE, still goes to the primary. Without
+DATABASE_REPLICA_URL ReadSessionLocal is the ordinary primary session and
+nothing here applies.
+
+Lag: a background job measures the replica's replay lag every
+DB_REPLICA_LAG_CHECK_SECONDS. Reads fall back to the primary while the last
+measurement is above DB_REPLICA_MAX_LAG_SECONDS, failed, or is too old.
+
+Read-your-writes: every committed user change goes through
+user_cache.invalidate(), which pins that user's email and UUID to the primary
+for longer than any lag a usable replica can have. A session that has
+written stays on the primary. A keyed lookup that misses on the replica is
+retried on the primary, so a user created moments ago (on any worker) is
+still found. Pins are per worker process; across workers an update can be
+seen up to DB_REPLICA_MAX_LAG_SECONDS late, the same bound as the local
+user cache TTL.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "")
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+DB_REPLICA_LAG_CHECK_SECONDS = float(os.getenv("DB_REPLICA_LAG_CHECK_SECONDS", "2"))
+# A lag reading older than this is treated as unknown (e.g. the check is stuck)
+DB_REPLICA_LAG_MAX_AGE_SECONDS = float(
+    os.getenv("DB_REPLICA_LAG_MAX_AGE_SECONDS", str(DB_REPLICA_LAG_CHECK_SECONDS * 3))
+)
+# Recently written users remembered per worker for read-your-writes
+DB_REPLICA_PIN_LIMIT = int(os.getenv("DB_REPLICA_PIN_LIMIT", "10000"))
+
+# A write is visible on a usable replica once the lag bound plus one
+# (possibly stale) lag reading have passed
+PIN_SECONDS = DB_REPLICA_MAX_LAG_SECONDS + DB_REPLICA_LAG_MAX_AGE_SECONDS
+
+# 0 when the standby has replayed everything it received, so an idle
+# primary does not read as growing lag; NULL before the first replay.
+_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+_lock = threading.Lock()
+_status = {
+    "ok": None,  # None until the first check completes
+    "lag_seconds": None,
+    "checked_at": None,
+    "error": None,
+    "consecutive_failures": 0,
+}
+_stats = {"replica_reads": 0, "primary_fallbacks": 0, "pinned_reads": 0, "miss_retries": 0}
+_pins = OrderedDict()  # "email:<normalized>" / "uid:<uuid>" -> monotonic expiry
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+# ----------------------------
+# Lag
+# ----------------------------
+def check_lag(engine=None):
+    """Measure the replica's replay lag once and record it; returns the lag in seconds or None"""
+    if engine is None:
+        from database import replica_engine as engine
+
+    try:
+        with engine.connect() as connection:
+            if engine.dialect.name == "postgresql":
+                lag = connection.execute(_LAG_SQL).scalar()
+                lag = float(lag) if lag is not None else None
+            else:
+                connection.execute(text("SELECT 1"))
+                lag = 0.0
+        error = None if lag is not None else "replica has not replayed any transaction yet"
+    except Exception as e:
+        lag, error = None, f"{type(e).__name__}: {e}"[:200]
+
+    with _lock:
+        _status["ok"] = lag is not None
+        _status["lag_seconds"] = round(lag, 3) if lag is not None else None
+        _status["checked_at"] = time.time()
+        _status["error"] = error
+        _status["consecutive_failures"] = 0 if lag is not None else _status["consecutive_failures"] + 1
+    return lag
+
+
+def run_check():
+    """Scheduled job: check the lag and log the first failure of a streak"""
+    if check_lag() is None and _status["consecutive_failures"] == 1:
+        print(f"❌ Read replica check failed: {_status['error']}")
+
+
+def is_usable():
+    """True when the last lag reading is recent and within DB_REPLICA_MAX_LAG_SECONDS"""
+    with _lock:
+        ok, lag, checked_at = _status["ok"], _status["lag_seconds"], _status["checked_at"]
+    return (
+        bool(ok)
+        and lag <= DB_REPLICA_MAX_LAG_SECONDS
+        and time.time() - checked_at <= DB_REPLICA_LAG_MAX_AGE_SECONDS
+    )
+
+
+# ----------------------------
+# Read-your-writes pins
+# ----------------------------
+def _keys(emails, user_ids):
+    return [f"email:{e}" for e in emails if e] + [f"uid:{u}" for u in user_ids if u]
+
+
+def pin(emails=(), user_ids=()):
+    """Send reads of these users (normalized emails / UUIDs) to the primary for PIN_SECONDS"""
+    expires_at = time.monotonic() + PIN_SECONDS
+    with _lock:
+        for key in _keys(emails, user_ids):
+            _pins[key] = expires_at
+            _pins.move_to_end(key)
+        while len(_pins) > DB_REPLICA_PIN_LIMIT:
+            _pins.popitem(last=False)
+
+
+def _is_pinned(key, now):
+    expires_at = _pins.get(key)
+    if expires_at is None:
+        return False
+    if expires_at <= now:
+        del _pins[key]
+        return False
+    return True
+
+
+# ----------------------------
+# Per-session routing (state lives in db.info, see database.RoutingSession)
+# ----------------------------
+def choose(info, is_write):
+    """"primary" or "replica" for the next statement of a routing session"""
+    if info.get("use_primary"):
+        return "primary"
+    if is_write:
+        info["use_primary"] = True  # read-your-writes for the rest of the session
+        return "primary"
+    if is_usable():
+        _count("replica_reads")
+        return "replica"
+    _count("primary_fallbacks")
+    return "primary"
+
+
+def use_primary(db):
+    """Send the rest of this session's statements to the primary"""
+    db.info["use_primary"] = True
+
+
+def route(db, emails=(), user_ids=()):
+    """Before a keyed read: stay on the primary if any of these users was written recently"""
+    if not db.info.get("routing") or db.info.get("use_primary"):
+        return
+    now = time.monotonic()
+    with _lock:
+        pinned = any(_is_pinned(key, now) for key in _keys(emails, user_ids))
+    if pinned:
+        _count("pinned_reads")
+        use_primary(db)
+
+
+def served_by_replica(db):
+    """True if db's last statement ran on the replica, i.e. its rows may be up to the max lag old"""
+    return db.info.get("bind") == "replica"
+
+
+def retry_on_primary(db):
+    """After a keyed read found nothing on the replica: switch db to the primary and return
+    True so the caller reads again (the row may have been created moments ago)"""
+    if not served_by_replica(db):
+        return False
+    _count("miss_retries")
+    use_primary(db)
+    return True
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats)
+        status = dict(_status)
+        stats["pins"] = len(_pins)
+    stats.update(status)
+    stats["configured"] = bool(DATABASE_REPLICA_URL)
+    stats["usable"] = is_usable() if DATABASE_REPLICA_URL else False
+    stats["max_lag_seconds"] = DB_REPLICA_MAX_LAG_SECONDS
+    return stats
@@ -0,0 +1,27 @@
+# responses.py
+"""
+orjson-rendered JSON responses.
+
+ORJSONResponse is the app's default response class, so plain dict returns
+are rendered by orjson instead of json.dumps. Handlers that already build
+the exact response shape (login, signup, refresh, the service lookups)
+return an ORJSONResponse themselves. FastAPI passes a returned Response
+through untouched, which skips both the response_model validation (EmailStr
+alone costs ~100 us per login) and jsonable_encoder. The response_model on
+those routes still documents the shape in OpenAPI.
+
+Content passed in directly must already be JSON-native: datetimes as
+isoformat() strings, as user_cache and serialize_user produce them.
+
+fastapi.responses.ORJSONResponse is deprecated in current FastAPI, hence
+this copy.
+"""
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
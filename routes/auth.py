@@ -1,12 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 import uuid
-import jwt
 import os
 
-from models import User
+from models import User, TokenPurpose
 from schemas import (
     UserCreate,
     LoginRequest,
@@ -15,14 +14,28 @@ from schemas import (
     ChangePasswordRequest,
     ResetPasswordRequest,
     ResetPasswordConfirm,
+    RefreshRequest,
+    TokenPairResponse,
+    UserPublic,
 )
+import audit
 import auth
-from database import SessionLocal
+import hashing
+import queries
+import ratelimit
+import rehash
+import sessions
+import tokens
+import user_cache
+from database import ReadSessionLocal, SessionLocal, dialect_insert
+from responses import ORJSONResponse
 
 router = APIRouter()
 
 # ----------------------------
-# DB session dependency
+# DB session dependencies
+# get_read_db is for endpoints that only read: it routes to the read replica
+# when one is configured (see replica.py).
 # ----------------------------
 def get_db():
     db = SessionLocal()
@@ -31,38 +44,49 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 # ----------------------------
 # SIGNUP (no email sent here)
 # Returns verificationToken for the blog app to email.
 # ----------------------------
 @router.post("/signup", response_model=SignupResponse)
 def signup(user: UserCreate, db: Session = Depends(get_db)):
-    # Enforce unique email
-    if db.query(User).filter(User.email == user.email).first():
-        raise HTTPException(status_code=400, detail="Email already registered")
-
-    hashed_password = auth.get_password_hash(user.password)
+    hashed_password = hashing.hash_password(user.password)
     generated_user_uuid = str(uuid.uuid4())
 
-    verification_token = str(uuid.uuid4())
     token_ttl_hours = int(os.getenv("EMAIL_VERIFICATION_TTL_HOURS", "24"))
-    expires_at = datetime.utcnow() + timedelta(hours=token_ttl_hours)
-
-    new_user = User(
-        user_id=generated_user_uuid,
-        email=user.email,
-        username=user.username,
-        hashed_password=hashed_password,
-        is_active=True,
-        is_verified=False,
-        email_verification_token=verification_token,
-        token_expiration=expires_at,
+
+    # Single round trip: the unique normalized-email index arbitrates concurrent
+    # signups, including case variants of the same address
+    stmt = (
+        dialect_insert(db.get_bind(), User)
+        .values(
+            user_id=generated_user_uuid,
+            email=user.email,
+            username=user.username,
+            hashed_password=hashed_password,
+            is_active=True,
+            is_verified=False,
+        )
+        .on_conflict_do_nothing(index_elements=[User.email_normalized])
+        .returning(User.id, User.user_id, User.email, User.username, User.is_active, User.is_verified)
+    )
+    new_user = db.execute(stmt).first()
+    if new_user is None:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Email already registered")
+    verification_token = tokens.issue_token(
+        db, new_user.id, TokenPurpose.EMAIL_VERIFICATION, timedelta(hours=token_ttl_hours)
     )
-    db.add(new_user)
     db.commit()
-    db.refresh(new_user)
 
-    return {
+    return ORJSONResponse({
         "id": new_user.id,
         "user_id": new_user.user_id,          # UUID
         "email": new_user.email,
@@ -70,49 +94,89 @@ def signup(user: UserCreate, db: Session = Depends(get_db)):
         "is_active": new_user.is_active,
         "is_verified": new_user.is_verified,
         "verificationToken": verification_token,
-    }
+    })
 
 # ----------------------------
 # LOGIN (requires verified email)
 # Returns bearer token + profile fields for blog auto-linking.
 # ----------------------------
 @router.post("/login", response_model=LoginResponse)
-def login(login_data: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == login_data.email).first()
-    if not user or not user.hashed_password or not auth.verify_password(login_data.password, user.hashed_password):
+def login(login_data: LoginRequest, request: Request, db: Session = Depends(get_db)):
+    ratelimit.check("login", request, login_data.email)
+    user = user_cache.load_credentials_by_email(db, login_data.email)
+    verified, new_hash = False, None
+    if user and user["hashed_password"]:
+        verified, new_hash = hashing.verify_and_update(login_data.password, user["hashed_password"])
+    if not verified:
+        audit.record(audit.LOGIN_FAILED, request, login_data.email, user)
         # generic message (no user enumeration)
         raise HTTPException(status_code=400, detail="Incorrect email or password")
+    if new_hash:
+        # Outdated hash under the current policy; written in the background
+        rehash.enqueue(user["id"], user["hashed_password"], new_hash, user["email"], user["user_id"])
 
-    if not user.is_verified:
+    if not user["is_verified"]:
+        audit.record(audit.LOGIN_UNVERIFIED, request, login_data.email, user)
         raise HTTPException(status_code=403, detail="Email not verified")
 
-    access_token = auth.create_access_token(data={"user_id": user.user_id})
+    access_token = auth.create_access_token(data={"user_id": user["user_id"]})
+    refresh_token = sessions.create_session(db, user["id"], user["user_id"])
+    db.commit()
+    audit.record(audit.LOGIN_SUCCEEDED, request, login_data.email, user)
 
-    return {
+    return ORJSONResponse({
         "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "user_id": user["user_id"],      # UUID
+        "email": user["email"],
+        "username": user["username"],
+        "is_active": user["is_active"],
+        "is_verified": user["is_verified"],
+    })
+
+# ----------------------------
+# REFRESH (rotates the refresh token; no password hash involved)
+# ----------------------------
+@router.post("/token/refresh", response_model=TokenPairResponse)
+def refresh_access_token(data: RefreshRequest, db: Session = Depends(get_db)):
+    rotated = sessions.rotate_session(db, data.refresh_token)
+    db.commit()  # also persists the revocation when a rotated token is replayed
+    if rotated is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    return ORJSONResponse({
+        "access_token": auth.create_access_token(data={"user_id": rotated.user_uuid}),
+        "refresh_token": rotated.refresh_token,
         "token_type": "bearer",
-        "user_id": user.user_id,      # UUID
-        "email": user.email,
-        "username": user.username,
-        "is_active": user.is_active,
-        "is_verified": user.is_verified,
-    }
+    })
+
+# ----------------------------
+# LOGOUT (revokes the session behind a refresh token)
+# ----------------------------
+@router.post("/logout")
+def logout(data: RefreshRequest, db: Session = Depends(get_db)):
+    sessions.revoke_session(db, data.refresh_token)
+    db.commit()
+    return {"message": "Logged out"}
 
 # ----------------------------
 # VERIFY EMAIL (token-based)
 # ----------------------------
 @router.get("/verify-email")
 def verify_email(token: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email_verification_token == token).first()
-    if not user:
+    found = tokens.find_live_token(db, token, TokenPurpose.EMAIL_VERIFICATION)
+    if not found:
         raise HTTPException(status_code=400, detail="Invalid verification token")
-    if user.token_expiration and user.token_expiration < datetime.utcnow():
+    if found.expires_at < datetime.utcnow():
         raise HTTPException(status_code=400, detail="Verification token expired")
 
-    user.is_verified = True
-    user.email_verification_token = None
-    user.token_expiration = None
+    if not tokens.consume_token(db, found.token_hash):
+        raise HTTPException(status_code=400, detail="Invalid verification token")
+    db.execute(queries.MARK_VERIFIED, {"pk": found.user_pk})
     db.commit()
+    auth.token_cache.invalidate_user(found.user_id)
+    user_cache.invalidate(email=found.email, user_id=found.user_id)
 
     return {"message": "Email verified successfully"}
 
@@ -121,15 +185,14 @@ def verify_email(token: str, db: Session = Depends(get_db)):
 # Returns resetToken for the blog app to email.
 # ----------------------------
 @router.post("/reset-password/request")
-def reset_password_request(request_data: ResetPasswordRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == request_data.email).first()
+def reset_password_request(request_data: ResetPasswordRequest, request: Request, db: Session = Depends(get_db)):
+    ratelimit.check("reset_password", request, request_data.email)
+    user = user_cache.load_credentials_by_email(db, request_data.email)
     if not user:
         # Do not disclose existence
         return {"message": "If the email exists, a reset link has been sent"}
 
-    reset_token = str(uuid.uuid4())
-    user.password_reset_token = reset_token
-    user.token_expiration = datetime.utcnow() + timedelta(hours=1)
+    reset_token = tokens.issue_token(db, user["id"], TokenPurpose.PASSWORD_RESET, timedelta(hours=1))
     db.commit()
 
     return {"message": "If the email exists, a reset link has been sent", "resetToken": reset_token}
@@ -139,38 +202,41 @@ def reset_password_request(request_data: ResetPasswordRequest, db: Session = Dep
 # ----------------------------
 @router.post("/reset-password/confirm")
 def reset_password_confirm(data: ResetPasswordConfirm, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.password_reset_token == data.token).first()
-    if not user:
+    found = tokens.find_live_token(db, data.token, TokenPurpose.PASSWORD_RESET)
+    if not found:
         raise HTTPException(status_code=400, detail="Invalid reset token")
-    if user.token_expiration and user.token_expiration < datetime.utcnow():
+    if found.expires_at < datetime.utcnow():
         raise HTTPException(status_code=400, detail="Reset token expired")
 
-    user.hashed_password = auth.get_password_hash(data.new_password)
-    user.password_reset_token = None
-    user.token_expiration = None
+    new_hash = hashing.hash_password(data.new_password)
+    if not tokens.consume_token(db, found.token_hash):
+        raise HTTPException(status_code=400, detail="Invalid reset token")
+    db.execute(queries.SET_PASSWORD, {"pk": found.user_pk, "new_hash": new_hash})
+    sessions.revoke_user_sessions(db, found.user_pk)
     db.commit()
+    auth.token_cache.invalidate_user(found.user_id)
+    user_cache.invalidate(email=found.email, user_id=found.user_id)
 
     return {"message": "Password reset successfully"}
 
 # ----------------------------
-# CHANGE PASSWORD (auth via token param)
+# CHANGE PASSWORD (auth via bearer token or token param)
 # ----------------------------
 @router.post("/change-password")
-def change_password(data: ChangePasswordRequest, token: str, db: Session = Depends(get_db)):
-    try:
-        payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-        user_id = payload.get("user_id")
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-    user = db.query(User).filter(User.user_id == user_id).first()
+def change_password(data: ChangePasswordRequest, current_user: auth.CurrentUser = Depends(auth.get_current_user),
+    db: Session = Depends(get_db)):
+    user = user_cache.load_credentials_by_user_id(db, current_user.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    if not auth.verify_password(data.old_password, user.hashed_password):
+    if not hashing.verify_password(data.old_password, user["hashed_password"]):
         raise HTTPException(status_code=400, detail="Old password is incorrect")
 
-    user.hashed_password = auth.get_password_hash(data.new_password)
+    new_hash = hashing.hash_password(data.new_password)
+    db.execute(queries.SET_PASSWORD, {"pk": user["id"], "new_hash": new_hash})
+    sessions.revoke_user_sessions(db, user["id"])
     db.commit()
+    auth.token_cache.invalidate_user(user["user_id"])
+    user_cache.invalidate(email=user["email"], user_id=user["user_id"])
 
     return {"message": "Password changed successfully"}
 
@@ -178,43 +244,36 @@ def change_password(data: ChangePasswordRequest, token: str, db: Session = Depen
 # UPDATED DELETE USER ENDPOINT
 # Make sure this endpoint exists and works properly
 # ----------------------------
-@router.delete("/users/{user_uuid}")
-def delete_user(user_uuid: str, db: Session = Depends(get_db),
-    x_service_token: str = Header(default="")):
-    internal_token = os.getenv("INTERNAL_SERVICE_TOKEN", "")
-    if not internal_token:
-        raise HTTPException(status_code=500, detail="Server missing INTERNAL_SERVICE_TOKEN")
-    if x_service_token != internal_token:
-        raise HTTPException(status_code=403, detail="Forbidden")
-    
-    user = db.query(User).filter(User.user_id == user_uuid).first()
-    if not user:
+@router.delete("/users/{user_uuid}", dependencies=[Depends(auth.require_service_token)])
+def delete_user(user_uuid: str, db: Session = Depends(get_db)):
+    email = db.execute(queries.DELETE_USER_BY_UUID, {"user_uuid": user_uuid}).scalar()
+    if email is None:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    db.delete(user)
+
     db.commit()
+    auth.token_cache.invalidate_user(user_uuid)
+    user_cache.invalidate(email=email, user_id=user_uuid)
     return {"message": "User deleted successfully"}
 
 
 @router.post("/verify-email/resend")
-def resend_verification_token(req: ResetPasswordRequest, db: Session = Depends(get_db)):
+def resend_verification_token(req: ResetPasswordRequest, request: Request, db: Session = Depends(get_db)):
     """
     Re-issue an email verification token for an unverified account.
     Returns: { verificationToken: "<token>" } on success.
     404 if user not found, 409 if already verified.
     """
-    user = db.query(User).filter(User.email == req.email).first()
+    ratelimit.check("resend_verification", request, req.email)
+    user = user_cache.load_credentials_by_email(db, req.email)
     if not user:
         # Keep explicit so the blog app can show the right message (it falls back to 409 guidance)
         return JSONResponse(status_code=404, content={"detail": "User not found"})
 
-    if user.is_verified:
+    if user["is_verified"]:
         return JSONResponse(status_code=409, content={"detail": "User already verified"})
 
     # Issue a fresh token and expiry (24h window)
-    new_token = str(uuid.uuid4())
-    user.email_verification_token = new_token
-    user.token_expiration = datetime.utcnow() + timedelta(hours=24)
+    new_token = tokens.issue_token(db, user["id"], TokenPurpose.EMAIL_VERIFICATION, timedelta(hours=24))
     db.commit()
 
     return {"verificationToken": new_token}
@@ -223,11 +282,10 @@ def resend_verification_token(req: ResetPasswordRequest, db: Session = Depends(g
 # GET USER BY EMAIL (service-to-service)
 # Protected by X-Service-Token header
 # ----------------------------
-@router.get("/users/by-email/{email}")
+@router.get("/users/by-email/{email}", response_model=UserPublic, dependencies=[Depends(auth.require_service_token)])
 def get_user_by_email(
-    email: str, 
-    db: Session = Depends(get_db),
-    x_service_token: str = Header(default="")
+    email: str,
+    db: Session = Depends(get_read_db),
 ):
     """
     Fetch user details by email for service-to-service communication.
@@ -237,25 +295,17 @@ def get_user_by_email(
     # Decode the email in case it's URL encoded
     email = urllib.parse.unquote(email)
     
-    internal_token = os.getenv("INTERNAL_SERVICE_TOKEN", "")
-    
-    if not internal_token:
-        raise HTTPException(status_code=500, detail="Server missing INTERNAL_SERVICE_TOKEN")
-    
-    if x_service_token != internal_token:
-        raise HTTPException(status_code=403, detail="Forbidden")
-    
-    user = db.query(User).filter(User.email == email).first()
+    user = user_cache.load_by_email(db, email)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {
-        "id": user.id,
-        "user_id": user.user_id,  # UUID
-        "email": user.email,
-        "username": user.username,
-        "is_active": user.is_active,
-        "is_verified": user.is_verified,
-        "created_at": user.created_at.isoformat() if user.created_at else None,
-    }
+    return ORJSONResponse({
+        "id": user["id"],
+        "user_id": user["user_id"],  # UUID
+        "email": user["email"],
+        "username": user["username"],
+        "is_active": user["is_active"],
+        "is_verified": user["is_verified"],
+        "created_at": user["created_at"],
+    })
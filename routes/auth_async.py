@@ -0,0 +1,307 @@
+# routes/auth_async.py
+# Async twin of routes/auth.py, mounted instead of it when DB_ASYNC=true.
+# Endpoints, payloads and status codes must stay identical between the two.
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+import uuid
+import os
+
+from models import User, TokenPurpose
+from schemas import (
+    UserCreate,
+    LoginRequest,
+    LoginResponse,
+    SignupResponse,
+    ChangePasswordRequest,
+    ResetPasswordRequest,
+    ResetPasswordConfirm,
+    RefreshRequest,
+    TokenPairResponse,
+    UserPublic,
+)
+import audit
+import auth
+import hashing
+import queries
+import ratelimit
+import rehash
+import sessions
+import tokens
+import user_cache
+import database
+from database import dialect_insert
+from responses import ORJSONResponse
+
+router = APIRouter()
+
+# ----------------------------
+# DB session dependencies
+# get_read_db is for endpoints that only read: it routes to the read replica
+# when one is configured (see replica.py).
+# ----------------------------
+async def get_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+async def get_read_db():
+    async with database.AsyncReadSessionLocal() as db:
+        yield db
+
+# ----------------------------
+# SIGNUP (no email sent here)
+# Returns verificationToken for the blog app to email.
+# ----------------------------
+@router.post("/signup", response_model=SignupResponse)
+async def signup(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    hashed_password = await hashing.ahash_password(user.password)
+    generated_user_uuid = str(uuid.uuid4())
+
+    token_ttl_hours = int(os.getenv("EMAIL_VERIFICATION_TTL_HOURS", "24"))
+
+    # Single round trip: the unique normalized-email index arbitrates concurrent
+    # signups, including case variants of the same address
+    stmt = (
+        dialect_insert(db.get_bind(), User)
+        .values(
+            user_id=generated_user_uuid,
+            email=user.email,
+            username=user.username,
+            hashed_password=hashed_password,
+            is_active=True,
+            is_verified=False,
+        )
+        .on_conflict_do_nothing(index_elements=[User.email_normalized])
+        .returning(User.id, User.user_id, User.email, User.username, User.is_active, User.is_verified)
+    )
+    new_user = (await db.execute(stmt)).first()
+    if new_user is None:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Email already registered")
+    verification_token = await tokens.aissue_token(
+        db, new_user.id, TokenPurpose.EMAIL_VERIFICATION, timedelta(hours=token_ttl_hours)
+    )
+    await db.commit()
+
+    return ORJSONResponse({
+        "id": new_user.id,
+        "user_id": new_user.user_id,          # UUID
+        "email": new_user.email,
+        "username": new_user.username,
+        "is_active": new_user.is_active,
+        "is_verified": new_user.is_verified,
+        "verificationToken": verification_token,
+    })
+
+# ----------------------------
+# LOGIN (requires verified email)
+# Returns bearer token + profile fields for blog auto-linking.
+# ----------------------------
+@router.post("/login", response_model=LoginResponse)
+async def login(login_data: LoginRequest, request: Request, db: AsyncSession = Depends(get_db)):
+    await ratelimit.acheck("login", request, login_data.email)
+    user = await user_cache.aload_credentials_by_email(db, login_data.email)
+    verified, new_hash = False, None
+    if user and user["hashed_password"]:
+        verified, new_hash = await hashing.averify_and_update(login_data.password, user["hashed_password"])
+    if not verified:
+        audit.record(audit.LOGIN_FAILED, request, login_data.email, user)
+        # generic message (no user enumeration)
+        raise HTTPException(status_code=400, detail="Incorrect email or password")
+    if new_hash:
+        # Outdated hash under the current policy; written in the background
+        rehash.enqueue(user["id"], user["hashed_password"], new_hash, user["email"], user["user_id"])
+
+    if not user["is_verified"]:
+        audit.record(audit.LOGIN_UNVERIFIED, request, login_data.email, user)
+        raise HTTPException(status_code=403, detail="Email not verified")
+
+    access_token = auth.create_access_token(data={"user_id": user["user_id"]})
+    refresh_token = await sessions.acreate_session(db, user["id"], user["user_id"])
+    await db.commit()
+    audit.record(audit.LOGIN_SUCCEEDED, request, login_data.email, user)
+
+    return ORJSONResponse({
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "user_id": user["user_id"],      # UUID
+        "email": user["email"],
+        "username": user["username"],
+        "is_active": user["is_active"],
+        "is_verified": user["is_verified"],
+    })
+
+# ----------------------------
+# REFRESH (rotates the refresh token; no password hash involved)
+# ----------------------------
+@router.post("/token/refresh", response_model=TokenPairResponse)
+async def refresh_access_token(data: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    rotated = await sessions.arotate_session(db, data.refresh_token)
+    await db.commit()  # also persists the revocation when a rotated token is replayed
+    if rotated is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    return ORJSONResponse({
+        "access_token": auth.create_access_token(data={"user_id": rotated.user_uuid}),
+        "refresh_token": rotated.refresh_token,
+        "token_type": "bearer",
+    })
+
+# ----------------------------
+# LOGOUT (revokes the session behind a refresh token)
+# ----------------------------
+@router.post("/logout")
+async def logout(data: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    await sessions.arevoke_session(db, data.refresh_token)
+    await db.commit()
+    return {"message": "Logged out"}
+
+# ----------------------------
+# VERIFY EMAIL (token-based)
+# ----------------------------
+@router.get("/verify-email")
+async def verify_email(token: str, db: AsyncSession = Depends(get_db)):
+    found = await tokens.afind_live_token(db, token, TokenPurpose.EMAIL_VERIFICATION)
+    if not found:
+        raise HTTPException(status_code=400, detail="Invalid verification token")
+    if found.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=400, detail="Verification token expired")
+
+    if not await tokens.aconsume_token(db, found.token_hash):
+        raise HTTPException(status_code=400, detail="Invalid verification token")
+    await db.execute(queries.MARK_VERIFIED, {"pk": found.user_pk})
+    await db.commit()
+    auth.token_cache.invalidate_user(found.user_id)
+    await user_cache.ainvalidate(email=found.email, user_id=found.user_id)
+
+    return {"message": "Email verified successfully"}
+
+# ----------------------------
+# RESET PASSWORD (REQUEST)
+# Returns resetToken for the blog app to email.
+# ----------------------------
+@router.post("/reset-password/request")
+async def reset_password_request(request_data: ResetPasswordRequest, request: Request, db: AsyncSession = Depends(get_db)):
+    await ratelimit.acheck("reset_password", request, request_data.email)
+    user = await user_cache.aload_credentials_by_email(db, request_data.email)
+    if not user:
+        # Do not disclose existence
+        return {"message": "If the email exists, a reset link has been sent"}
+
+    reset_token = await tokens.aissue_token(db, user["id"], TokenPurpose.PASSWORD_RESET, timedelta(hours=1))
+    await db.commit()
+
+    return {"message": "If the email exists, a reset link has been sent", "resetToken": reset_token}
+
+# ----------------------------
+# RESET PASSWORD (CONFIRM)
+# ----------------------------
+@router.post("/reset-password/confirm")
+async def reset_password_confirm(data: ResetPasswordConfirm, db: AsyncSession = Depends(get_db)):
+    found = await tokens.afind_live_token(db, data.token, TokenPurpose.PASSWORD_RESET)
+    if not found:
+        raise HTTPException(status_code=400, detail="Invalid reset token")
+    if found.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=400, detail="Reset token expired")
+
+    new_hash = await hashing.ahash_password(data.new_password)
+    if not await tokens.aconsume_token(db, found.token_hash):
+        raise HTTPException(status_code=400, detail="Invalid reset token")
+    await db.execute(queries.SET_PASSWORD, {"pk": found.user_pk, "new_hash": new_hash})
+    await sessions.arevoke_user_sessions(db, found.user_pk)
+    await db.commit()
+    auth.token_cache.invalidate_user(found.user_id)
+    await user_cache.ainvalidate(email=found.email, user_id=found.user_id)
+
+    return {"message": "Password reset successfully"}
+
+# ----------------------------
+# CHANGE PASSWORD (auth via bearer token or token param)
+# ----------------------------
+@router.post("/change-password")
+async def change_password(data: ChangePasswordRequest, current_user: auth.CurrentUser = Depends(auth.get_current_user_async),
+    db: AsyncSession = Depends(get_db)):
+    user = await user_cache.aload_credentials_by_user_id(db, current_user.user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not await hashing.averify_password(data.old_password, user["hashed_password"]):
+        raise HTTPException(status_code=400, detail="Old password is incorrect")
+
+    new_hash = await hashing.ahash_password(data.new_password)
+    await db.execute(queries.SET_PASSWORD, {"pk": user["id"], "new_hash": new_hash})
+    await sessions.arevoke_user_sessions(db, user["id"])
+    await db.commit()
+    auth.token_cache.invalidate_user(user["user_id"])
+    await user_cache.ainvalidate(email=user["email"], user_id=user["user_id"])
+
+    return {"message": "Password changed successfully"}
+
+# ----------------------------
+# DELETE USER (service-to-service)
+# ----------------------------
+@router.delete("/users/{user_uuid}", dependencies=[Depends(auth.require_service_token)])
+async def delete_user(user_uuid: str, db: AsyncSession = Depends(get_db)):
+    email = (await db.execute(queries.DELETE_USER_BY_UUID, {"user_uuid": user_uuid})).scalar()
+    if email is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    await db.commit()
+    auth.token_cache.invalidate_user(user_uuid)
+    await user_cache.ainvalidate(email=email, user_id=user_uuid)
+    return {"message": "User deleted successfully"}
+
+
+@router.post("/verify-email/resend")
+async def resend_verification_token(req: ResetPasswordRequest, request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Re-issue an email verification token for an unverified account.
+    Returns: { verificationToken: "<token>" } on success.
+    404 if user not found, 409 if already verified.
+    """
+    await ratelimit.acheck("resend_verification", request, req.email)
+    user = await user_cache.aload_credentials_by_email(db, req.email)
+    if not user:
+        return JSONResponse(status_code=404, content={"detail": "User not found"})
+
+    if user["is_verified"]:
+        return JSONResponse(status_code=409, content={"detail": "User already verified"})
+
+    # Issue a fresh token and expiry (24h window)
+    new_token = await tokens.aissue_token(db, user["id"], TokenPurpose.EMAIL_VERIFICATION, timedelta(hours=24))
+    await db.commit()
+
+    return {"verificationToken": new_token}
+
+# ----------------------------
+# GET USER BY EMAIL (service-to-service)
+# Protected by X-Service-Token header
+# ----------------------------
+@router.get("/users/by-email/{email}", response_model=UserPublic, dependencies=[Depends(auth.require_service_token)])
+async def get_user_by_email(
+    email: str,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Fetch user details by email for service-to-service communication.
+    Protected by internal service token.
+    """
+    import urllib.parse
+    # Decode the email in case it's URL encoded
+    email = urllib.parse.unquote(email)
+
+    user = await user_cache.aload_by_email(db, email)
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return ORJSONResponse({
+        "id": user["id"],
+        "user_id": user["user_id"],  # UUID
+        "email": user["email"],
+        "username": user["username"],
+        "is_active": user["is_active"],
+        "is_verified": user["is_verified"],
+        "created_at": user["created_at"],
+    })
@@ -0,0 +1,282 @@
+# routes/users.py
+# Service-to-service user management endpoints (X-Service-Token protected).
+# These run on the sync engine in both DB_ASYNC modes. The read endpoints use
+# ReadSessionLocal, which routes to the read replica when one is configured,
+# and return their JSON-native payloads as ORJSONResponse (see responses.py).
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import String, any_, bindparam, or_, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from datetime import datetime
+from typing import Optional
+import asyncio
+import csv
+import io
+import json
+import orjson
+import os
+import tempfile
+
+from models import User, normalize_email
+from schemas import USER_LOOKUP_MAX_ITEMS, UserLookupRequest
+import audit
+import auth
+import bulk_import
+import replica
+from database import ReadSessionLocal, engine
+from responses import ORJSONResponse
+
+router = APIRouter(dependencies=[Depends(auth.require_service_token)])
+
+# Request bodies above this size spill from memory to a temp file
+IMPORT_SPOOL_MAX_BYTES = int(os.getenv("IMPORT_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# Page size cap for GET /users; exports are unbounded but streamed
+USER_LIST_MAX_LIMIT = int(os.getenv("USER_LIST_MAX_LIMIT", "1000"))
+# Rows fetched per server-side cursor round trip during exports
+USER_EXPORT_BATCH_SIZE = int(os.getenv("USER_EXPORT_BATCH_SIZE", "1000"))
+
+# ----------------------------
+# BULK IMPORT
+# Body is JSONL (default) or CSV with a header row. Returns a per-row report.
+# Hashing is capped at BULK_IMPORT_HTTP_WORKERS processes and one import runs
+# per worker at a time, so imports can't starve logins; large plaintext-password
+# imports belong in import_users.py.
+# ----------------------------
+_import_lock = asyncio.Lock()
+
+@router.post("/users/import")
+async def import_users(request: Request, format: str = "jsonl"):
+    if format not in ("jsonl", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'jsonl' or 'csv'")
+    if _import_lock.locked():
+        raise HTTPException(status_code=409, detail="Another import is running, retry when it has finished")
+
+    async with _import_lock:
+        with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MAX_BYTES) as spool:
+            async for chunk in request.stream():
+                # A blocking file write once the spool has rolled over to disk
+                await run_in_threadpool(spool.write, chunk)
+            spool.seek(0)
+            text = io.TextIOWrapper(spool, encoding="utf-8", newline="")
+            try:
+                return await run_in_threadpool(
+                    bulk_import.import_users, text, format, workers=bulk_import.BULK_IMPORT_HTTP_WORKERS
+                )
+            except UnicodeDecodeError:
+                raise HTTPException(status_code=400, detail="Import body must be UTF-8")
+            finally:
+                text.detach()
+
+# ----------------------------
+# Shared helpers
+# ----------------------------
+USER_PUBLIC_COLUMNS = (
+    User.id, User.user_id, User.email, User.username,
+    User.is_active, User.is_verified, User.created_at,
+)
+
+def serialize_user(row):
+    """Same shape as GET /auth/users/by-email/{email}"""
+    return {
+        "id": row.id,
+        "user_id": row.user_id,  # UUID
+        "email": row.email,
+        "username": row.username,
+        "is_active": row.is_active,
+        "is_verified": row.is_verified,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+    }
+
+def _match_any(column, name, values, dialect_name):
+    if dialect_name == "postgresql":
+        # One array parameter instead of N bind params: a single plan for any list size
+        return column == any_(bindparam(name, values, type_=ARRAY(String)))
+    return column.in_(values)
+
+def _lookup_stmt(emails, user_ids):
+    dialect_name = engine.dialect.name
+    conditions = []
+    if emails:
+        conditions.append(_match_any(User.email_normalized, "emails", emails, dialect_name))
+    if user_ids:
+        conditions.append(_match_any(User.user_id, "user_ids", user_ids, dialect_name))
+    return select(*USER_PUBLIC_COLUMNS).where(or_(*conditions)).order_by(User.id)
+
+# ----------------------------
+# BATCH LOOKUP
+# Resolve up to USER_LOOKUP_MAX_ITEMS emails and/or UUIDs in one query.
+# Send Accept: application/x-ndjson (or ?stream=true) to stream rows as they are read.
+# ----------------------------
+@router.post("/users/lookup")
+def lookup_users(data: UserLookupRequest, request: Request, stream: bool = False):
+    emails = list(dict.fromkeys(normalize_email(e) for e in data.emails))
+    user_ids = list(dict.fromkeys(data.user_ids))
+    if len(emails) + len(user_ids) > USER_LOOKUP_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {USER_LOOKUP_MAX_ITEMS} emails/user_ids per request")
+    if not emails and not user_ids:
+        return ORJSONResponse({"users": [], "missing_emails": [], "missing_user_ids": []})
+
+    stmt = _lookup_stmt(emails, user_ids)
+
+    if stream or "application/x-ndjson" in request.headers.get("accept", ""):
+        def generate():
+            with ReadSessionLocal() as db:
+                replica.route(db, emails, user_ids)
+                missing_emails, missing_ids = set(emails), set(user_ids)
+                result = db.execute(stmt.execution_options(stream_results=True, yield_per=500))
+                for row in result:
+                    missing_emails.discard(normalize_email(row.email))
+                    missing_ids.discard(row.user_id)
+                    yield orjson.dumps(serialize_user(row)) + b"\n"
+                if (missing_emails or missing_ids) and replica.retry_on_primary(db):
+                    # Rows already streamed can't be re-sent: read only the keys
+                    # the replica didn't have
+                    retry = _lookup_stmt(sorted(missing_emails), sorted(missing_ids))
+                    for row in db.execute(retry.execution_options(stream_results=True, yield_per=500)):
+                        yield orjson.dumps(serialize_user(row)) + b"\n"
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    with ReadSessionLocal() as db:
+        replica.route(db, emails, user_ids)
+        users = [serialize_user(row) for row in db.execute(stmt)]
+        if len(users) < len(emails) + len(user_ids) and replica.retry_on_primary(db):
+            # Some keys may belong to users created since the replica last caught up
+            users = [serialize_user(row) for row in db.execute(stmt)]
+    found_emails = {normalize_email(u["email"]) for u in users}
+    found_ids = {u["user_id"] for u in users}
+    return ORJSONResponse({
+        "users": users,
+        "missing_emails": [e for e in emails if e not in found_emails],
+        "missing_user_ids": [u for u in user_ids if u not in found_ids],
+    })
+
+# ----------------------------
+# LIST / EXPORT
+# Keyset pagination on id: pass the previous page's next_after_id as after_id.
+# format=ndjson or format=csv streams every matching row after after_id through
+# a server-side cursor, so memory stays flat however many users match.
+# ----------------------------
+USER_EXPORT_FIELDS = ("id", "user_id", "email", "username", "is_active", "is_verified", "created_at")
+
+def _list_stmt(after_id, is_verified, is_active, created_after, created_before):
+    stmt = select(*USER_PUBLIC_COLUMNS).where(User.id > after_id)
+    if is_verified is not None:
+        stmt = stmt.where(User.is_verified == is_verified)
+    if is_active is not None:
+        stmt = stmt.where(User.is_active == is_active)
+    if created_after is not None:
+        stmt = stmt.where(User.created_at >= created_after)
+    if created_before is not None:
+        stmt = stmt.where(User.created_at < created_before)
+    return stmt.order_by(User.id)
+
+def _export_rows(stmt, format):
+    with ReadSessionLocal() as db:
+        result = db.execute(stmt.execution_options(stream_results=True, yield_per=USER_EXPORT_BATCH_SIZE))
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(USER_EXPORT_FIELDS)
+            for rows in result.partitions():
+                for row in rows:
+                    writer.writerow(serialize_user(row).values())
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()  # header only: nothing matched
+        else:
+            for rows in result.partitions():
+                yield "".join(json.dumps(serialize_user(row)) + "\n" for row in rows)
+
+@router.get("/users")
+def list_users(
+    after_id: int = 0,
+    limit: int = 100,
+    is_verified: Optional[bool] = None,
+    is_active: Optional[bool] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    format: str = "json",
+):
+    if format not in ("json", "ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'json', 'ndjson' or 'csv'")
+    stmt = _list_stmt(after_id, is_verified, is_active, created_after, created_before)
+
+    if format == "csv":
+        return StreamingResponse(
+            _export_rows(stmt, format),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="users.csv"'},
+        )
+    if format == "ndjson":
+        return StreamingResponse(_export_rows(stmt, format), media_type="application/x-ndjson")
+
+    if not 1 <= limit <= USER_LIST_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {USER_LIST_MAX_LIMIT}")
+    with ReadSessionLocal() as db:
+        # One extra row tells us whether another page exists without a COUNT
+        rows = db.execute(stmt.limit(limit + 1)).all()
+    users = [serialize_user(row) for row in rows[:limit]]
+    return ORJSONResponse({
+        "users": users,
+        "next_after_id": users[-1]["id"] if len(rows) > limit else None,
+    })
+
+# ----------------------------
+# LOGIN EVENTS
+# Newest first, keyset-paginated on (occurred_at, id): pass next_cursor back as
+# cursor. Bound the range with since/until so PostgreSQL only scans the
+# matching monthly partitions.
+# ----------------------------
+def _parse_cursor(cursor):
+    occurred_at, _, event_id = cursor.partition(",")
+    try:
+        return datetime.fromisoformat(occurred_at), event_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/login-events")
+def list_login_events(
+    user_id: Optional[str] = None,
+    email: Optional[str] = None,
+    event: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+):
+    if not 1 <= limit <= USER_LIST_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {USER_LIST_MAX_LIMIT}")
+    before = _parse_cursor(cursor) if cursor else None
+    email = normalize_email(email)
+    stmt = audit.events_stmt(user_id, email, event, since, until, before).limit(limit + 1)
+
+    with ReadSessionLocal() as db:
+        rows = db.execute(stmt).all()
+        last_login = None
+        if user_id is not None or email is not None:
+            last_login = db.execute(audit.last_login_stmt(user_id, email)).first()
+
+    events = [
+        {
+            "id": row.id,
+            "occurred_at": row.occurred_at.isoformat(),
+            "event": row.event,
+            "user_id": row.user_id,
+            "email": row.email,
+            "ip": row.ip,
+            "user_agent": row.user_agent,
+        }
+        for row in rows[:limit]
+    ]
+    return ORJSONResponse({
+        "events": events,
+        "next_cursor": f"{events[-1]['occurred_at']},{events[-1]['id']}" if len(rows) > limit else None,
+        "last_login": {
+            "at": last_login.last_login_at.isoformat(),
+            "ip": last_login.last_login_ip,
+        } if last_login else None,
+    })
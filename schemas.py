@@ -1,5 +1,9 @@
-from typing import Optional, Literal
-from pydantic import BaseModel, EmailStr
+import os
+from typing import List, Optional, Literal
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+
+# Maximum emails + user_ids accepted by one /users/lookup call
+USER_LOOKUP_MAX_ITEMS = int(os.getenv("USER_LOOKUP_MAX_ITEMS", "1000"))
 
 # ---------- Users ----------
 
@@ -15,8 +19,7 @@ class UserResponse(UserBase):
     is_active: bool
     is_verified: bool
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # ---------- Auth / Tokens ----------
 
@@ -26,6 +29,7 @@ class Token(BaseModel):
 
 class LoginResponse(BaseModel):
     access_token: str
+    refresh_token: str
     token_type: Literal["bearer"]
     user_id: str            # credential UUID
     email: EmailStr
@@ -33,8 +37,15 @@ class LoginResponse(BaseModel):
     is_active: bool
     is_verified: bool
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class TokenPairResponse(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: Literal["bearer"]
 
 class SignupResponse(BaseModel):
     id: int
@@ -45,8 +56,7 @@ class SignupResponse(BaseModel):
     is_verified: bool
     verificationToken: str  # <-- added
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class TokenData(BaseModel):
     user_id: Optional[str] = None
@@ -70,3 +80,23 @@ class ResetPasswordConfirm(BaseModel):
 
 class VerifyEmailRequest(BaseModel):
     token: str
+
+# ---------- Service-to-service ----------
+
+class UserPublic(BaseModel):
+    """GET /auth/users/by-email/{email}; also one entry of the lookup and list responses"""
+    id: int
+    user_id: str            # credential UUID
+    email: EmailStr
+    username: str
+    is_active: bool
+    is_verified: bool
+    created_at: Optional[str] = None   # ISO 8601
+
+    model_config = ConfigDict(from_attributes=True)
+
+class UserLookupRequest(BaseModel):
+    # Checked before the items are, so an oversized list fails without
+    # validating every address; the combined limit is enforced by the route
+    emails: List[EmailStr] = Field(default=[], max_length=USER_LOOKUP_MAX_ITEMS)
+    user_ids: List[str] = Field(default=[], max_length=USER_LOOKUP_MAX_ITEMS)  # credential UUIDs
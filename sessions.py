@@ -0,0 +1,221 @@
+# sessions.py
+"""
+Opaque refresh tokens with rotation and reuse detection.
+
+Login opens a session (one auth_sessions row) and returns a random refresh
+token; only its SHA-256 digest is stored. Each refresh swaps the session's
+refresh_hash for a new one in a single conditional UPDATE ... RETURNING, so
+renewal is one indexed write instead of a bcrypt verify. The replaced digest
+is kept in previous_hash: presenting it again means the token was copied, and
+the whole session is revoked.
+
+A per-worker hot set remembers recently issued and recently rotated tokens so
+refreshes hit the primary key and replays are recognised without the
+secondary-index lookup. The database stays authoritative: every rotation is
+still conditional on the stored hash, so a stale hot set can only cost an
+extra query, never accept a revoked token.
+"""
+import os
+import secrets
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+
+import queries
+from models import AuthSession
+from tokens import TOKEN_SWEEP_BATCH_SIZE, hash_token
+
+REFRESH_TOKEN_TTL_DAYS = int(os.getenv("REFRESH_TOKEN_TTL_DAYS", "30"))
+# A replay this soon after rotation is treated as a client retry race, not theft
+REFRESH_REUSE_GRACE_SECONDS = int(os.getenv("REFRESH_REUSE_GRACE_SECONDS", "5"))
+SESSION_HOT_SET_SIZE = int(os.getenv("SESSION_HOT_SET_SIZE", "10000"))
+
+Rotated = namedtuple("Rotated", ["refresh_token", "user_uuid"])
+HotEntry = namedtuple("HotEntry", ["session_id", "user_uuid", "expires_at", "rotated_at"])
+
+
+class HotSet:
+    """Bounded LRU of token digest -> HotEntry"""
+
+    def __init__(self, maxsize=SESSION_HOT_SET_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+            return entry
+
+    def put(self, digest, session_id, user_uuid, expires_at, rotated_at=None):
+        with self._lock:
+            self._entries[digest] = HotEntry(session_id, user_uuid, expires_at, rotated_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def size(self):
+        return len(self._entries)
+
+
+hot_set = HotSet()
+
+
+def _new_token():
+    return secrets.token_urlsafe(32)
+
+
+def _open_session(user_pk, user_uuid, now):
+    token = _new_token()
+    session = AuthSession(
+        id=str(uuid.uuid4()),
+        user_id=user_pk,
+        user_uuid=user_uuid,
+        refresh_hash=hash_token(token),
+        created_at=now,
+        expires_at=now + timedelta(days=REFRESH_TOKEN_TTL_DAYS),
+    )
+    return session, token
+
+
+def _rotate_args(old_digest, new_token, now, entry):
+    params = {"old_hash": old_digest, "new_hash": hash_token(new_token), "now": now}
+    if entry is None:
+        return queries.ROTATE_SESSION, params
+    return queries.ROTATE_SESSION_BY_ID, {**params, "session_id": entry.session_id}
+
+
+def _remember(old_digest, new_token, row, now):
+    hot_set.put(old_digest, row.id, row.user_uuid, row.expires_at, rotated_at=now)
+    hot_set.put(hash_token(new_token), row.id, row.user_uuid, row.expires_at)
+    return Rotated(new_token, row.user_uuid)
+
+
+def _is_theft(rotated_at, now):
+    return rotated_at is None or (now - rotated_at).total_seconds() > REFRESH_REUSE_GRACE_SECONDS
+
+
+# ----------------------------
+# Sync API (routes/auth.py)
+# ----------------------------
+def create_session(db, user_pk: int, user_uuid: str) -> str:
+    """Open a session for a successful login and return the raw refresh token; the caller commits"""
+    now = datetime.utcnow()
+    session, token = _open_session(user_pk, user_uuid, now)
+    db.add(session)
+    hot_set.put(session.refresh_hash, session.id, user_uuid, session.expires_at)
+    return token
+
+
+def rotate_session(db, token: str):
+    """Exchange a refresh token for a new one; returns Rotated or None. The caller commits
+    either way, since a replayed token revokes its session."""
+    now = datetime.utcnow()
+    digest = hash_token(token)
+    entry = hot_set.get(digest)
+    if entry is not None and entry.rotated_at is not None:
+        if _is_theft(entry.rotated_at, now):
+            db.execute(queries.REVOKE_SESSION_BY_ID, {"session_id": entry.session_id, "now": now})
+        return None
+    if entry is not None and entry.expires_at <= now:
+        return None
+
+    new_token = _new_token()
+    row = db.execute(*_rotate_args(digest, new_token, now, entry)).first()
+    if row is not None:
+        return _remember(digest, new_token, row, now)
+
+    replayed = db.execute(queries.REPLAYED_SESSION, {"old_hash": digest}).first()
+    if replayed is not None and _is_theft(replayed.last_used_at, now):
+        db.execute(queries.REVOKE_SESSION_BY_ID, {"session_id": replayed.id, "now": now})
+    return None
+
+
+def revoke_session(db, token: str):
+    """Log out the session holding this refresh token; the caller commits"""
+    db.execute(queries.REVOKE_SESSION_BY_HASH, {"digest": hash_token(token), "now": datetime.utcnow()})
+
+
+def revoke_user_sessions(db, user_pk: int):
+    """Revoke every session of a user (password change/reset); the caller commits"""
+    db.execute(queries.REVOKE_USER_SESSIONS, {"user_pk": user_pk, "now": datetime.utcnow()})
+
+
+# ----------------------------
+# Async API (routes/auth_async.py)
+# ----------------------------
+async def acreate_session(db, user_pk: int, user_uuid: str) -> str:
+    now = datetime.utcnow()
+    session, token = _open_session(user_pk, user_uuid, now)
+    db.add(session)
+    hot_set.put(session.refresh_hash, session.id, user_uuid, session.expires_at)
+    return token
+
+
+async def arotate_session(db, token: str):
+    now = datetime.utcnow()
+    digest = hash_token(token)
+    entry = hot_set.get(digest)
+    if entry is not None and entry.rotated_at is not None:
+        if _is_theft(entry.rotated_at, now):
+            await db.execute(queries.REVOKE_SESSION_BY_ID, {"session_id": entry.session_id, "now": now})
+        return None
+    if entry is not None and entry.expires_at <= now:
+        return None
+
+    new_token = _new_token()
+    row = (await db.execute(*_rotate_args(digest, new_token, now, entry))).first()
+    if row is not None:
+        return _remember(digest, new_token, row, now)
+
+    replayed = (await db.execute(queries.REPLAYED_SESSION, {"old_hash": digest})).first()
+    if replayed is not None and _is_theft(replayed.last_used_at, now):
+        await db.execute(queries.REVOKE_SESSION_BY_ID, {"session_id": replayed.id, "now": now})
+    return None
+
+
+async def arevoke_session(db, token: str):
+    await db.execute(queries.REVOKE_SESSION_BY_HASH, {"digest": hash_token(token), "now": datetime.utcnow()})
+
+
+async def arevoke_user_sessions(db, user_pk: int):
+    await db.execute(queries.REVOKE_USER_SESSIONS, {"user_pk": user_pk, "now": datetime.utcnow()})
+
+
+# ----------------------------
+# Expired-session sweeper
+# ----------------------------
+def sweep_expired(batch_size=TOKEN_SWEEP_BATCH_SIZE):
+    """Delete expired sessions in batches of batch_size; returns the number removed"""
+    from database import SessionLocal
+
+    removed = 0
+    while True:
+        with SessionLocal() as db:
+            batch = (
+                select(AuthSession.id)
+                .where(AuthSession.expires_at < datetime.utcnow())
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            result = db.execute(delete(AuthSession).where(AuthSession.id.in_(batch)))
+            db.commit()
+        removed += result.rowcount
+        if result.rowcount < batch_size:
+            return removed
+
+
+def sweep_job():
+    """Scheduled job: delete expired sessions"""
+    removed = sweep_expired()
+    if removed:
+        print(f"🧹 Removed {removed} expired sessions")
+
+
+def get_stats():
+    return {"hot_set_size": hot_set.size(), "hot_set_maxsize": hot_set.maxsize}
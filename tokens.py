@@ -0,0 +1,184 @@
+# tokens.py
+"""
+One-time email verification and password reset tokens.
+
+Raw tokens are only ever returned to the caller; the user_tokens table stores
+their SHA-256 digest as the primary key, so every lookup is a single index
+probe. Issuing a new token revokes the user's previous live token of the same
+purpose. Background jobs (see jobs.py) delete expired rows in small batches.
+
+Tokens issued before user_tokens existed sit in the legacy single-slot columns
+on users. migrate_legacy_columns() moves the live ones into user_tokens,
+hashed and with their original expiry, so links already emailed keep working.
+It then clears the columns. It runs once at startup and keeps running until
+the columns are empty.
+"""
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, or_, select, update
+
+import queries
+from models import TokenPurpose, User, UserToken
+
+TOKEN_SWEEP_INTERVAL_SECONDS = int(os.getenv("TOKEN_SWEEP_INTERVAL_SECONDS", "300"))
+TOKEN_SWEEP_BATCH_SIZE = int(os.getenv("TOKEN_SWEEP_BATCH_SIZE", "1000"))
+
+# Expiry for a legacy token stored without one (the old verify-email handler
+# cleared token_expiration but could leave a reset token behind)
+_LEGACY_DEFAULT_TTL = {
+    TokenPurpose.EMAIL_VERIFICATION: timedelta(hours=int(os.getenv("EMAIL_VERIFICATION_TTL_HOURS", "24"))),
+    TokenPurpose.PASSWORD_RESET: timedelta(hours=1),
+}
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+# ----------------------------
+# Sync API (routes/auth.py)
+# ----------------------------
+def issue_token(db, user_pk: int, purpose: TokenPurpose, ttl: timedelta) -> str:
+    """Create a token for user_pk and return the raw value; the caller commits"""
+    now = datetime.utcnow()
+    token = str(uuid.uuid4())
+    db.execute(queries.REVOKE_LIVE_TOKENS, {"user_pk": user_pk, "token_purpose": purpose, "now": now})
+    db.add(UserToken(token_hash=hash_token(token), user_id=user_pk, purpose=purpose, expires_at=now + ttl))
+    return token
+
+
+def find_live_token(db, token: str, purpose: TokenPurpose):
+    """Return a (token_hash, expires_at, user_pk, user_id, email) row for an unconsumed token,
+    or None. Expiry is left to the caller."""
+    return db.execute(queries.LIVE_TOKEN, {"digest": hash_token(token), "token_purpose": purpose}).first()
+
+
+def consume_token(db, token_hash: str) -> bool:
+    """Mark a found token used; False if a concurrent request consumed it first. The caller commits."""
+    return db.execute(queries.CONSUME_TOKEN, {"digest": token_hash, "now": datetime.utcnow()}).rowcount == 1
+
+
+# ----------------------------
+# Async API (routes/auth_async.py)
+# ----------------------------
+async def aissue_token(db, user_pk: int, purpose: TokenPurpose, ttl: timedelta) -> str:
+    now = datetime.utcnow()
+    token = str(uuid.uuid4())
+    await db.execute(queries.REVOKE_LIVE_TOKENS, {"user_pk": user_pk, "token_purpose": purpose, "now": now})
+    db.add(UserToken(token_hash=hash_token(token), user_id=user_pk, purpose=purpose, expires_at=now + ttl))
+    return token
+
+
+async def afind_live_token(db, token: str, purpose: TokenPurpose):
+    return (await db.execute(queries.LIVE_TOKEN, {"digest": hash_token(token), "token_purpose": purpose})).first()
+
+
+async def aconsume_token(db, token_hash: str) -> bool:
+    return (await db.execute(queries.CONSUME_TOKEN, {"digest": token_hash, "now": datetime.utcnow()})).rowcount == 1
+
+
+# ----------------------------
+# Expired-token sweeper
+# ----------------------------
+def sweep_expired(batch_size=TOKEN_SWEEP_BATCH_SIZE):
+    """Delete expired tokens in batches of batch_size; returns the number removed"""
+    from database import SessionLocal
+
+    removed = 0
+    while True:
+        with SessionLocal() as db:
+            batch = (
+                select(UserToken.token_hash)
+                .where(UserToken.expires_at < datetime.utcnow())
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            result = db.execute(delete(UserToken).where(UserToken.token_hash.in_(batch)))
+            db.commit()
+        removed += result.rowcount
+        if result.rowcount < batch_size:
+            return removed
+
+
+def _legacy_token_rows(row, now):
+    """user_tokens rows for the live legacy tokens of one users row"""
+    legacy = (
+        (row.email_verification_token, TokenPurpose.EMAIL_VERIFICATION),
+        (row.password_reset_token, TokenPurpose.PASSWORD_RESET),
+    )
+    rows = []
+    for token, purpose in legacy:
+        if not token:
+            continue
+        expires_at = row.token_expiration or now + _LEGACY_DEFAULT_TTL[purpose]
+        if expires_at > now:
+            rows.append({"token_hash": hash_token(token), "user_id": row.id, "purpose": purpose, "expires_at": expires_at})
+    return rows
+
+
+def migrate_legacy_columns(batch_size=TOKEN_SWEEP_BATCH_SIZE):
+    """Move live tokens from the legacy users columns into user_tokens and clear the
+    columns, in batches; returns (users cleared, tokens migrated). Idempotent."""
+    from database import SessionLocal, dialect_insert
+
+    cleared = migrated = 0
+    while True:
+        with SessionLocal() as db:
+            now = datetime.utcnow()
+            users = db.execute(
+                select(User.id, User.email_verification_token, User.password_reset_token, User.token_expiration)
+                .where(or_(
+                    User.email_verification_token.is_not(None),
+                    User.password_reset_token.is_not(None),
+                    User.token_expiration.is_not(None),
+                ))
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            live = [token_row for row in users for token_row in _legacy_token_rows(row, now)]
+            if live:
+                db.execute(
+                    dialect_insert(db.get_bind(), UserToken)
+                    .values(live)
+                    .on_conflict_do_nothing(index_elements=[UserToken.token_hash])
+                )
+            if users:
+                db.execute(
+                    update(User)
+                    .where(User.id.in_([row.id for row in users]))
+                    # Housekeeping, not a profile edit: leave updated_at alone
+                    .values(
+                        email_verification_token=None,
+                        password_reset_token=None,
+                        token_expiration=None,
+                        updated_at=User.updated_at,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+        cleared += len(users)
+        migrated += len(live)
+        if len(users) < batch_size:
+            return cleared, migrated
+
+
+def sweep_job():
+    """Scheduled job: delete expired user_tokens rows"""
+    removed = sweep_expired()
+    if removed:
+        print(f"🧹 Removed {removed} expired user tokens")
+
+
+def legacy_sweep_job():
+    """Scheduled job: drain the legacy columns, then unschedule. Nothing writes them any
+    more, so once a sweep finds nothing there is no reason to keep scanning users."""
+    import jobs
+
+    cleared, migrated = migrate_legacy_columns()
+    if cleared:
+        print(f"🧹 Cleared legacy tokens from {cleared} users ({migrated} still live, moved to user_tokens)")
+        return None
+    return jobs.STOP
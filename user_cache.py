@@ -0,0 +1,320 @@
+# user_cache.py
+"""
+Read-through cache of user profiles, keyed by normalized email and by
+user_id (UUID).
+
+The by-email lookup and bearer-token resolution (auth.get_current_user, by
+user_id) read through this cache instead of re-selecting the User row on every
+request. Every route that mutates a user must call invalidate()
+after committing.
+
+Profiles hold public fields only. Login, change-password and the reset/resend
+requests call load_credentials_by_*, which always read the primary. The local
+backend's invalidation only reaches one worker, so a cached copy elsewhere can
+be up to USER_CACHE_TTL_SECONDS stale. A stale copy must never decide whether a
+password is accepted or a token issued.
+
+Backends (USER_CACHE_BACKEND):
+  local  - in-process LRU with TTL (default). Invalidation only reaches the
+           current worker, so keep USER_CACHE_TTL_SECONDS short when running
+           several workers or replicas.
+  redis  - shared cache at USER_CACHE_URL; any Redis-protocol server works
+           (Redis, Valkey, KeyDB, Dragonfly). Requires the `redis` package.
+  none   - caching disabled.
+
+The a*-prefixed functions are for the async router. With the redis backend
+they run the blocking client calls in a worker thread so a slow Redis can't
+stall the event loop; the local backend is called inline.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import queries
+import replica
+from models import normalize_email
+
+USER_CACHE_BACKEND = os.getenv("USER_CACHE_BACKEND", "local").lower()
+USER_CACHE_URL = os.getenv("USER_CACHE_URL", "redis://localhost:6379/0")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+
+
+class LocalBackend:
+    remote = False
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set_many(self, mapping):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    remote = True  # blocking network calls: the async API offloads them
+
+    def __init__(self, url=USER_CACHE_URL, ttl=USER_CACHE_TTL_SECONDS):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("USER_CACHE_BACKEND=redis requires the 'redis' package")
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+
+    def get(self, key):
+        raw = self._client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set_many(self, mapping):
+        pipe = self._client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, json.dumps(value), ex=self.ttl)
+        pipe.execute()
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*keys)
+
+    def size(self):
+        return None
+
+
+def _create_backend():
+    if USER_CACHE_BACKEND == "none":
+        return None
+    if USER_CACHE_BACKEND == "redis":
+        return RedisBackend()
+    return LocalBackend()
+
+
+backend = _create_backend()
+_stats = {"hits": 0, "misses": 0, "errors": 0, "invalidations": 0}
+_stats_lock = threading.Lock()
+
+# key -> monotonic time of its last invalidation in this process, so a load
+# that raced with a write can't put the pre-write row back (see _put)
+_invalidated = OrderedDict()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _email_key(email):
+    return f"user:email:{normalize_email(email)}"
+
+
+def _user_id_key(user_id):
+    return f"user:uid:{user_id}"
+
+
+def _to_profile(row):
+    return {
+        "id": row.id,
+        "user_id": row.user_id,
+        "email": row.email,
+        "username": row.username,
+        "is_active": row.is_active,
+        "is_verified": row.is_verified,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+    }
+
+
+def _to_credentials(row):
+    return {
+        "id": row.id,
+        "user_id": row.user_id,
+        "email": row.email,
+        "username": row.username,
+        "hashed_password": row.hashed_password,
+        "is_active": row.is_active,
+        "is_verified": row.is_verified,
+    }
+
+
+def _get(key):
+    if backend is None:
+        return None
+    try:
+        profile = backend.get(key)
+    except Exception:
+        _count("errors")
+        return None
+    _count("hits" if profile is not None else "misses")
+    return profile
+
+
+def _put(profile, loaded_at):
+    """Cache a profile read at loaded_at, unless the user was invalidated since"""
+    if backend is None or profile is None:
+        return
+    keys = (_email_key(profile["email"]), _user_id_key(profile["user_id"]))
+    with _stats_lock:
+        if any(_invalidated.get(key, float("-inf")) >= loaded_at for key in keys):
+            return
+    try:
+        backend.set_many({key: profile for key in keys})
+    except Exception:
+        _count("errors")
+
+
+def invalidate(email=None, user_id=None):
+    """Drop a user from the cache; call after any committed change to the row"""
+    # Read-only sessions on this worker go to the primary for this user until
+    # the replica has caught up
+    replica.pin(emails=[normalize_email(email)] if email else (), user_ids=[user_id] if user_id else ())
+    if backend is None:
+        return
+    keys = []
+    if email:
+        keys.append(_email_key(email))
+    if user_id:
+        keys.append(_user_id_key(user_id))
+    now = time.monotonic()
+    with _stats_lock:
+        for key in keys:
+            _invalidated[key] = now
+            _invalidated.move_to_end(key)
+        while len(_invalidated) > USER_CACHE_SIZE:
+            _invalidated.popitem(last=False)
+    try:
+        backend.delete(*keys)
+        _count("invalidations")
+    except Exception:
+        _count("errors")
+
+
+async def _offload(fn, *args, **kwargs):
+    if backend is not None and backend.remote:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+
+async def ainvalidate(email=None, user_id=None):
+    await _offload(invalidate, email=email, user_id=user_id)
+
+
+# ----------------------------
+# Read-through loaders (return a profile dict or None)
+# db may be a read-replica session (database.ReadSessionLocal). Rows read from
+# the replica are returned but never cached, so a lagging replica can't extend
+# how long a pre-change profile is served.
+# ----------------------------
+def _load(db, stmt, params, emails=(), user_ids=()):
+    loaded_at = time.monotonic()
+    replica.route(db, emails, user_ids)
+    row = db.execute(stmt, params).first()
+    if row is None and replica.retry_on_primary(db):
+        row = db.execute(stmt, params).first()
+    profile = _to_profile(row) if row else None
+    if not replica.served_by_replica(db):
+        _put(profile, loaded_at)
+    return profile
+
+
+async def _aload(db, stmt, params, emails=(), user_ids=()):
+    loaded_at = time.monotonic()
+    replica.route(db, emails, user_ids)
+    row = (await db.execute(stmt, params)).first()
+    if row is None and replica.retry_on_primary(db):
+        row = (await db.execute(stmt, params)).first()
+    profile = _to_profile(row) if row else None
+    if not replica.served_by_replica(db):
+        await _offload(_put, profile, loaded_at)
+    return profile
+
+
+def load_by_email(db, email):
+    email = normalize_email(email)
+    profile = _get(_email_key(email))
+    if profile is None:
+        profile = _load(db, queries.PROFILE_BY_EMAIL, {"email": email}, emails=[email])
+    return profile
+
+
+async def aload_by_email(db, email):
+    email = normalize_email(email)
+    profile = await _offload(_get, _email_key(email))
+    if profile is None:
+        profile = await _aload(db, queries.PROFILE_BY_EMAIL, {"email": email}, emails=[email])
+    return profile
+
+
+def load_by_user_id(db, user_id):
+    profile = _get(_user_id_key(user_id))
+    if profile is None:
+        profile = _load(db, queries.PROFILE_BY_UUID, {"user_uuid": user_id}, user_ids=[user_id])
+    return profile
+
+
+async def aload_by_user_id(db, user_id):
+    profile = await _offload(_get, _user_id_key(user_id))
+    if profile is None:
+        profile = await _aload(db, queries.PROFILE_BY_UUID, {"user_uuid": user_id}, user_ids=[user_id])
+    return profile
+
+
+# ----------------------------
+# Credentials (never cached; db must be a primary session)
+# Profile fields plus hashed_password, for the paths that check a password or
+# issue a token
+# ----------------------------
+def load_credentials_by_email(db, email):
+    row = db.execute(queries.CREDENTIALS_BY_EMAIL, {"email": normalize_email(email)}).first()
+    return _to_credentials(row) if row else None
+
+
+def load_credentials_by_user_id(db, user_id):
+    row = db.execute(queries.CREDENTIALS_BY_UUID, {"user_uuid": user_id}).first()
+    return _to_credentials(row) if row else None
+
+
+async def aload_credentials_by_email(db, email):
+    row = (await db.execute(queries.CREDENTIALS_BY_EMAIL, {"email": normalize_email(email)})).first()
+    return _to_credentials(row) if row else None
+
+
+async def aload_credentials_by_user_id(db, user_id):
+    row = (await db.execute(queries.CREDENTIALS_BY_UUID, {"user_uuid": user_id})).first()
+    return _to_credentials(row) if row else None
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["backend"] = USER_CACHE_BACKEND
+    stats["size"] = backend.size() if backend is not None else 0
+    return stats